@@ -0,0 +1,100 @@
+"""
+Shared OAuth credential handling for the Google Drive and Sheets services.
+"""
+import functools
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    import google_auth_httplib2
+    from google.oauth2.credentials import Credentials
+
+logger = logging.getLogger(__name__)
+
+# Refresh tokens ahead of expiry so long runs don't hit a mid-request expiry
+REFRESH_MARGIN = timedelta(minutes=5)
+
+_thread_local = threading.local()
+
+
+def _is_fresh(creds: Optional['Credentials']) -> bool:
+    """Check whether credentials are valid and not about to expire."""
+    if not creds or not creds.valid:
+        return False
+    if creds.expiry is None:
+        return True
+    # google-auth stores expiry as a naive UTC datetime
+    return creds.expiry - datetime.utcnow() > REFRESH_MARGIN
+
+
+@functools.lru_cache(maxsize=None)
+def load_credentials(credentials_file: str, token_file: str, scopes: Tuple[str, ...]) -> 'Credentials':
+    """
+    Load OAuth credentials, refreshing or re-authorizing only when needed.
+
+    Results are cached per (credentials_file, token_file, scopes), so every
+    service in the process shares one Credentials object.
+
+    Args:
+        credentials_file: Path to credentials.json file
+        token_file: Path to token.json file for storing auth tokens
+        scopes: Tuple of OAuth scopes required
+
+    Returns:
+        Authorized credentials
+    """
+    from google.oauth2.credentials import Credentials
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    creds = None
+    saved_token = None
+
+    # Load saved credentials if they exist
+    if os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, list(scopes))
+        saved_token = creds.token
+
+    # If credentials are invalid, missing or close to expiry, get new ones
+    if not _is_fresh(creds):
+        if creds and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(credentials_file, list(scopes))
+            creds = flow.run_local_server(port=0)
+
+    # Save credentials for next run, but only if the token changed
+    if creds.token != saved_token:
+        with open(token_file, 'w') as token:
+            token.write(creds.to_json())
+        logger.debug(f"Saved refreshed credentials to {token_file}")
+
+    return creds
+
+
+def authorized_http(credentials: 'Credentials') -> 'google_auth_httplib2.AuthorizedHttp':
+    """
+    Get the authorized HTTP transport for the calling thread.
+
+    httplib2 connections are not thread-safe, so each thread gets its own
+    transport, shared by every service running on that thread.
+
+    Args:
+        credentials: Credentials to authorize requests with
+
+    Returns:
+        Authorized HTTP transport bound to the current thread
+    """
+    http = getattr(_thread_local, 'http', None)
+    if http is None or http.credentials is not credentials:
+        import google_auth_httplib2
+        from googleapiclient.http import build_http
+
+        # build_http sets the client library's default socket timeout and
+        # keeps 308s (resumable uploads) from being followed as redirects
+        http = google_auth_httplib2.AuthorizedHttp(credentials, http=build_http())
+        _thread_local.http = http
+    return http
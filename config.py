@@ -19,6 +19,9 @@ class Config:
     DRIVE_FOLDER_ID = os.getenv('DRIVE_FOLDER_ID', '')
     DRIVE_CREDENTIALS_FILE = os.getenv('DRIVE_CREDENTIALS_FILE', 'credentials.json')
     DRIVE_TOKEN_FILE = os.getenv('DRIVE_TOKEN_FILE', 'token.json')
+    DRIVE_PARENTS_PER_QUERY = int(os.getenv('DRIVE_PARENTS_PER_QUERY', '10'))
+    DRIVE_PATH_GLOB = os.getenv('DRIVE_PATH_GLOB', '')
+    PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', '.pdf_cache')
     
     # Google Sheets Settings
     SHEETS_SPREADSHEET_ID = os.getenv('SHEETS_SPREADSHEET_ID', '')
@@ -28,6 +31,7 @@ class Config:
     VERTEX_AI_MODEL = os.getenv('VERTEX_AI_MODEL', 'gemini-1.5-flash')
     VERTEX_AI_MAX_OUTPUT_TOKENS = int(os.getenv('VERTEX_AI_MAX_OUTPUT_TOKENS', '2048'))
     VERTEX_AI_TEMPERATURE = float(os.getenv('VERTEX_AI_TEMPERATURE', '0.2'))
+    VERTEX_AI_CACHE_FILE = os.getenv('VERTEX_AI_CACHE_FILE', '.coupon_cache.sqlite3')
     
     # Application Settings
     MAX_WORKERS = int(os.getenv('MAX_WORKERS', '5'))
@@ -56,3 +60,8 @@ class Config:
                 f"Missing required configuration: {', '.join(missing_fields)}. "
                 "Please set these in your .env file or environment variables."
             )
+        
+        # Either being below 1 would leave the Drive crawl waiting forever
+        for field in ('MAX_WORKERS', 'DRIVE_PARENTS_PER_QUERY'):
+            if getattr(cls, field) < 1:
+                raise ValueError(f"{field} must be at least 1, got {getattr(cls, field)}")
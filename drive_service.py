@@ -2,17 +2,35 @@
 Google Drive service for crawling folder structures and accessing PDF files.
 """
 import logging
-import os
-from typing import List, Dict, Optional
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from fnmatch import fnmatchcase
+from typing import List, Dict, Optional, Tuple
+import google_auth_httplib2
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from tenacity import retry, stop_after_attempt, wait_exponential
+
+from auth import load_credentials, authorized_http
+from retry_utils import http_retry, is_retryable_http_error
 
 logger = logging.getLogger(__name__)
 
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+PDF_MIME_TYPE = 'application/pdf'
+
+# Listing responses only carry what the crawl and the Sheets rows consume;
+# the full field set is reserved for per-file metadata lookups.
+CRAWL_FIELDS = "nextPageToken, files(id, name, mimeType, parents, createdTime, modifiedTime)"
+FILE_METADATA_FIELDS = "id, name, mimeType, parents, createdTime, modifiedTime, size, webViewLink"
+
+
+def _parent_depth(file: Dict, depth_by_folder: Dict[str, int]) -> int:
+    """Get the crawl depth of the listed folder a file was found in."""
+    for parent in file.get('parents', []):
+        if parent in depth_by_folder:
+            return depth_by_folder[parent]
+    return 0
+
 
 class GoogleDriveService:
     """Service for interacting with Google Drive API."""
@@ -29,40 +47,29 @@ class GoogleDriveService:
         self.credentials_file = credentials_file
         self.token_file = token_file
         self.scopes = scopes
+        self.credentials = None
         self.service = None
         self._authenticate()
     
     def _authenticate(self):
         """Authenticate with Google Drive API."""
-        creds = None
+        creds = load_credentials(self.credentials_file, self.token_file, tuple(self.scopes))
         
-        # Load saved credentials if they exist
-        if os.path.exists(self.token_file):
-            creds = Credentials.from_authorized_user_file(self.token_file, self.scopes)
-        
-        # If credentials are invalid or don't exist, get new ones
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self.credentials_file, self.scopes
-                )
-                creds = flow.run_local_server(port=0)
-            
-            # Save credentials for next run
-            with open(self.token_file, 'w') as token:
-                token.write(creds.to_json())
-        
-        self.service = build('drive', 'v3', credentials=creds)
+        self.credentials = creds
+        self.service = build('drive', 'v3', http=authorized_http(creds))
         logger.info("Successfully authenticated with Google Drive API")
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    def _http(self) -> google_auth_httplib2.AuthorizedHttp:
+        """Get the authorized HTTP transport for the calling thread."""
+        return authorized_http(self.credentials)
+    
+    @http_retry
     def list_files_in_folder(
         self, 
         folder_id: str, 
         mime_type: Optional[str] = None,
-        page_token: Optional[str] = None
+        page_token: Optional[str] = None,
+        fields: str = CRAWL_FIELDS
     ) -> Dict:
         """
         List files in a specific folder.
@@ -71,6 +78,7 @@ class GoogleDriveService:
             folder_id: ID of the folder to list files from
             mime_type: Optional MIME type filter (e.g., 'application/pdf')
             page_token: Token for pagination
+            fields: Partial response field selector
             
         Returns:
             Dictionary with 'files' list and 'nextPageToken' if more results exist
@@ -84,73 +92,195 @@ class GoogleDriveService:
                 q=query,
                 pageSize=1000,
                 pageToken=page_token,
-                fields="nextPageToken, files(id, name, mimeType, parents, createdTime, modifiedTime)"
-            ).execute()
+                fields=fields
+            ).execute(http=self._http())
             
             return results
         except HttpError as error:
             logger.error(f"Error listing files in folder {folder_id}: {error}")
             raise
     
+    @http_retry
+    def list_files_in_folders(
+        self,
+        folder_ids: List[str],
+        pdf_only: bool = False,
+        page_token: Optional[str] = None,
+        fields: str = CRAWL_FIELDS
+    ) -> Dict:
+        """
+        List the children of several folders with a single query.
+        
+        Args:
+            folder_ids: IDs of the folders to list files from
+            pdf_only: If True, only return PDF files and folders
+            page_token: Token for pagination
+            fields: Partial response field selector
+            
+        Returns:
+            Dictionary with 'files' list and 'nextPageToken' if more results exist.
+            Each file's 'parents' field identifies the folder it belongs to.
+        """
+        try:
+            parents_clause = " or ".join(f"'{folder_id}' in parents" for folder_id in folder_ids)
+            query = f"({parents_clause}) and trashed=false"
+            if pdf_only:
+                query += f" and (mimeType='{PDF_MIME_TYPE}' or mimeType='{FOLDER_MIME_TYPE}')"
+            
+            results = self.service.files().list(
+                q=query,
+                pageSize=1000,
+                pageToken=page_token,
+                fields=fields
+            ).execute(http=self._http())
+            
+            return results
+        except HttpError as error:
+            logger.error(f"Error listing files in folders {', '.join(folder_ids)}: {error}")
+            raise
+    
+    def _list_folder_children(self, folder_ids: List[str], pdf_only: bool) -> Tuple[List[Dict], List[Dict]]:
+        """
+        List every page of a group of folders.
+        
+        Args:
+            folder_ids: IDs of the folders to list
+            pdf_only: If True, only return PDF files
+            
+        Returns:
+            Tuple of (matching files, child folders)
+        """
+        files_found = []
+        subfolders = []
+        add_file = files_found.append
+        add_subfolder = subfolders.append
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        page_token = None
+        
+        while True:
+            try:
+                results = self.list_files_in_folders(folder_ids, pdf_only=pdf_only, page_token=page_token)
+                files = results.get('files', [])
+                
+                for file in files:
+                    mime_type = file.get('mimeType', '')
+                    
+                    # If it's a folder, add to processing queue
+                    if mime_type == FOLDER_MIME_TYPE:
+                        add_subfolder(file)
+                    # If it's a PDF (or any file if pdf_only is False), add to results
+                    elif not pdf_only or mime_type == PDF_MIME_TYPE:
+                        add_file(file)
+                        if debug_enabled:
+                            logger.debug(f"Found file: {file['name']}")
+                
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+                    
+            except HttpError as error:
+                logger.error(f"Error processing folders {', '.join(folder_ids)}: {error}")
+                break
+        
+        return files_found, subfolders
+    
     def crawl_folder_structure(
         self, 
         root_folder_id: str, 
-        pdf_only: bool = True
+        pdf_only: bool = True,
+        max_workers: int = 5,
+        parents_per_query: int = 10,
+        path_glob: Optional[str] = None
     ) -> List[Dict]:
         """
         Recursively crawl folder structure to find all PDF files.
         
+        Sibling folders are independent, so up to ``max_workers`` listings are
+        kept in flight at once, each covering up to ``parents_per_query``
+        folders in a single query.
+        
+        ``path_glob`` restricts the crawl to matching folder paths below the
+        root, one glob per level (e.g. ``'Dealerships/*/Proofs'``). Folders
+        whose name doesn't match their level's glob are never listed; once
+        every level has matched, the whole subtree is crawled and only files
+        from that subtree are returned.
+        
         Args:
             root_folder_id: ID of the root folder to start crawling
             pdf_only: If True, only return PDF files
+            max_workers: Maximum number of concurrent folder listings
+            parents_per_query: Maximum number of folders combined into one query
+            path_glob: Optional '/'-separated folder name globs to follow
             
         Returns:
             List of file metadata dictionaries
+            
+        Raises:
+            ValueError: If max_workers or parents_per_query is less than 1
         """
+        if max_workers < 1:
+            raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+        if parents_per_query < 1:
+            raise ValueError(f"parents_per_query must be at least 1, got {parents_per_query}")
+        
         all_files = []
-        folders_to_process = [root_folder_id]
+        folders_to_process = deque([root_folder_id])
         processed_folders = set()
+        segments = path_glob.strip('/').split('/') if path_glob else []
+        depth_by_folder = {root_folder_id: 0}
         
         logger.info(f"Starting folder crawl from root: {root_folder_id}")
         
-        while folders_to_process:
-            current_folder = folders_to_process.pop(0)
-            
-            if current_folder in processed_folders:
-                continue
-            
-            processed_folders.add(current_folder)
-            logger.info(f"Processing folder: {current_folder} ({len(processed_folders)} folders processed)")
+        next_folder = folders_to_process.popleft
+        mark_processed = processed_folders.add
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
             
-            page_token = None
-            while True:
-                try:
-                    results = self.list_files_in_folder(current_folder, page_token=page_token)
-                    files = results.get('files', [])
+            while folders_to_process or pending:
+                # Keep the pool saturated with groups of unvisited folders
+                while folders_to_process and len(pending) < max_workers:
+                    chunk = []
+                    while folders_to_process and len(chunk) < parents_per_query:
+                        current_folder = next_folder()
+                        if current_folder not in processed_folders:
+                            mark_processed(current_folder)
+                            chunk.append(current_folder)
+                    
+                    if not chunk:
+                        continue
+                    
+                    logger.info(f"Processing {len(chunk)} folders ({len(processed_folders)} folders processed)")
+                    pending.add(executor.submit(self._list_folder_children, chunk, pdf_only))
+                
+                if not pending:
+                    continue
+                
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subfolders = future.result()
+                    
+                    if not segments:
+                        all_files.extend(files)
+                        folders_to_process.extend(folder['id'] for folder in subfolders)
+                        continue
                     
                     for file in files:
-                        mime_type = file.get('mimeType', '')
-                        
-                        # If it's a folder, add to processing queue
-                        if mime_type == 'application/vnd.google-apps.folder':
-                            folders_to_process.append(file['id'])
-                        # If it's a PDF (or any file if pdf_only is False), add to results
-                        elif not pdf_only or mime_type == 'application/pdf':
+                        if _parent_depth(file, depth_by_folder) >= len(segments):
                             all_files.append(file)
-                            logger.debug(f"Found file: {file['name']}")
                     
-                    page_token = results.get('nextPageToken')
-                    if not page_token:
-                        break
-                        
-                except HttpError as error:
-                    logger.error(f"Error processing folder {current_folder}: {error}")
-                    break
+                    for folder in subfolders:
+                        depth = _parent_depth(folder, depth_by_folder)
+                        if depth < len(segments) and not fnmatchcase(folder['name'], segments[depth]):
+                            logger.debug(f"Skipping folder outside {path_glob}: {folder['name']}")
+                            continue
+                        depth_by_folder.setdefault(folder['id'], depth + 1)
+                        folders_to_process.append(folder['id'])
         
         logger.info(f"Crawl complete. Found {len(all_files)} files in {len(processed_folders)} folders")
         return all_files
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    @http_retry
     def get_file_metadata(self, file_id: str) -> Dict:
         """
         Get detailed metadata for a specific file.
@@ -164,14 +294,88 @@ class GoogleDriveService:
         try:
             file = self.service.files().get(
                 fileId=file_id,
-                fields="id, name, mimeType, parents, createdTime, modifiedTime, size, webViewLink"
-            ).execute()
+                fields=FILE_METADATA_FIELDS
+            ).execute(http=self._http())
             return file
         except HttpError as error:
             logger.error(f"Error getting file metadata for {file_id}: {error}")
             raise
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    @http_retry
+    def _execute_metadata_batch(self, pending: List[str], metadata_by_id: Dict[str, Dict]):
+        """
+        Fetch metadata for a group of files in one batch HTTP request.
+        
+        Each part of a batch succeeds or fails on its own, and rate limiting
+        usually shows up as failed parts rather than a failed batch. Parts
+        that failed with a retryable error are left in ``pending`` and the
+        first such error is raised, so ``http_retry`` resubmits just those
+        files; other failures are logged and dropped.
+        
+        Args:
+            pending: IDs of the files still to fetch (at most the batch
+                limit); narrowed in place to the files worth retrying
+            metadata_by_id: Dictionary receiving each fetched file's metadata
+        """
+        errors_by_id = {}
+        
+        def handle_response(request_id, response, exception):
+            if exception is not None:
+                errors_by_id[request_id] = exception
+            else:
+                metadata_by_id[request_id] = response
+        
+        batch = self.service.new_batch_http_request(callback=handle_response)
+        for file_id in pending:
+            batch.add(
+                self.service.files().get(fileId=file_id, fields=FILE_METADATA_FIELDS),
+                request_id=file_id
+            )
+        batch.execute(http=self._http())
+        
+        retryable = []
+        for file_id, error in errors_by_id.items():
+            if is_retryable_http_error(error):
+                retryable.append(file_id)
+            else:
+                logger.error(f"Error getting file metadata for {file_id}: {error}")
+        
+        pending[:] = retryable
+        if retryable:
+            logger.warning(f"Retrying metadata for {len(retryable)} files after transient errors")
+            raise errors_by_id[retryable[0]]
+    
+    def get_files_metadata(self, file_ids: List[str], batch_size: int = 25) -> Dict[str, Dict]:
+        """
+        Get detailed metadata for many files using the Drive batch endpoint.
+        
+        Requests are grouped ``batch_size`` at a time into a single
+        multipart HTTP round trip. Larger batches are prone to server errors,
+        so the default stays well below the API maximum of 100. Media
+        downloads cannot be batched and still go through
+        ``download_file_content``. Files whose part of a batch hit a rate
+        limit or server error are retried in a smaller batch.
+        
+        Args:
+            file_ids: IDs of the files
+            batch_size: Number of requests per batch HTTP call
+            
+        Returns:
+            Dictionary mapping file ID to its metadata; files that failed are omitted
+        """
+        metadata_by_id = {}
+        
+        for i in range(0, len(file_ids), batch_size):
+            chunk = file_ids[i:i + batch_size]
+            try:
+                self._execute_metadata_batch(chunk, metadata_by_id)
+            except HttpError as error:
+                logger.error(f"Error executing metadata batch, {len(chunk)} files left unfetched: {error}")
+        
+        logger.info(f"Retrieved metadata for {len(metadata_by_id)}/{len(file_ids)} files")
+        return metadata_by_id
+    
+    @http_retry
     def download_file_content(self, file_id: str) -> bytes:
         """
         Download file content.
@@ -184,7 +388,7 @@ class GoogleDriveService:
         """
         try:
             request = self.service.files().get_media(fileId=file_id)
-            file_content = request.execute()
+            file_content = request.execute(http=self._http())
             return file_content
         except HttpError as error:
             logger.error(f"Error downloading file {file_id}: {error}")
@@ -0,0 +1,195 @@
+"""
+Local caches that let reruns skip expensive remote calls.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CouponInfoCache:
+    """SQLite-backed LRU cache of Vertex AI coupon extraction results."""
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        """
+        Initialize the coupon info cache.
+
+        Args:
+            path: Path to the SQLite database file
+            max_entries: Maximum number of results kept; least recently used go first
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        try:
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS coupon_info "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+                )
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS coupon_info_last_used ON coupon_info (last_used)"
+                )
+            # Tracked so set() only evicts once the table is actually over the limit
+            self._size = self._conn.execute("SELECT COUNT(*) FROM coupon_info").fetchone()[0]
+        except sqlite3.Error:
+            # e.g. the file exists but isn't a SQLite database
+            self._conn.close()
+            raise
+        logger.info(f"Using coupon info cache: {path}")
+
+    @staticmethod
+    def make_key(
+        filename: str,
+        metadata: Dict,
+        pdf_content: Optional[bytes] = None,
+        **params: Any
+    ) -> str:
+        """
+        Build a stable cache key from everything that shapes the model's answer.
+
+        Args:
+            filename: Name of the PDF file
+            metadata: Extracted metadata from filename/path
+            pdf_content: Optional PDF content as bytes
+            **params: Model settings (model name, temperature, ...)
+
+        Returns:
+            Hex digest identifying the request
+        """
+        pdf_digest = hashlib.sha256(pdf_content).hexdigest() if pdf_content else None
+        payload = json.dumps(
+            [filename, sorted(metadata.items()), pdf_digest, sorted(params.items())],
+            default=str
+        )
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached result.
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            Cached result, or None on a miss
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value FROM coupon_info WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE coupon_info SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        """
+        Store a result, evicting the least recently used entries past max_entries.
+
+        Args:
+            key: Key from make_key
+            value: JSON-serializable result
+        """
+        with self._lock, self._conn:
+            exists = self._conn.execute(
+                "SELECT 1 FROM coupon_info WHERE key = ?", (key,)
+            ).fetchone() is not None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO coupon_info (key, value, last_used) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+            if not exists:
+                self._size += 1
+            if self._size > self.max_entries:
+                # Only the oldest few index entries are read, not the whole table
+                self._conn.execute(
+                    "DELETE FROM coupon_info WHERE key IN "
+                    "(SELECT key FROM coupon_info ORDER BY last_used LIMIT ?)",
+                    (self._size - self.max_entries,)
+                )
+                self._size = self.max_entries
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+class PdfContentCache:
+    """Filesystem cache of downloaded PDFs, keyed by Drive file ID and modifiedTime."""
+
+    def __init__(self, directory: str):
+        """
+        Initialize the PDF content cache.
+
+        Args:
+            directory: Directory holding one subdirectory of versions per file
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        logger.info(f"Using PDF content cache: {directory}")
+
+    def _path(self, file_id: str, modified_time: str) -> str:
+        """Get the cache path for one version of a file."""
+        # ':' in RFC 3339 timestamps isn't valid in Windows file names
+        return os.path.join(self.directory, file_id, f"{modified_time.replace(':', '-')}.pdf")
+
+    def get(self, file_id: str, modified_time: str) -> Optional[bytes]:
+        """
+        Look up cached PDF content.
+
+        Args:
+            file_id: Google Drive file ID
+            modified_time: File's modifiedTime from the Drive listing
+
+        Returns:
+            PDF content as bytes, or None on a miss
+        """
+        try:
+            with open(self._path(file_id, modified_time), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, file_id: str, modified_time: str, content: bytes):
+        """
+        Store PDF content, replacing any older versions of the same file.
+
+        Args:
+            file_id: Google Drive file ID
+            modified_time: File's modifiedTime from the Drive listing
+            content: PDF content as bytes
+        """
+        file_dir = os.path.join(self.directory, file_id)
+        path = self._path(file_id, modified_time)
+        os.makedirs(file_dir, exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial PDF
+        fd, tmp_path = tempfile.mkstemp(dir=file_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        # Drop older versions; another writer's files may vanish underneath us
+        current = os.path.basename(path)
+        for name in os.listdir(file_dir):
+            if name.endswith('.pdf') and name != current:
+                try:
+                    os.unlink(os.path.join(file_dir, name))
+                except FileNotFoundError:
+                    pass
@@ -6,17 +6,23 @@ extracts metadata, uses Vertex AI to extract coupon offers,
 and logs results to Google Sheets.
 """
 import logging
+import queue
+import re
+import sqlite3
 import sys
-import json
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 from datetime import datetime
-from typing import List, Dict
+from typing import Any, Callable, Iterable, Iterator, List, Dict, Optional
 import coloredlogs
 
 from config import Config
 from drive_service import GoogleDriveService
 from sheets_service import GoogleSheetsService
-from vertex_ai_service import VertexAIService
+from vertex_ai_service import VertexAIService, dumps_coupon_info, parse_coupon_info
 from metadata_extractor import MetadataExtractor
+from local_cache import CouponInfoCache, PdfContentCache
 
 # Configure logging
 coloredlogs.install(
@@ -25,6 +31,53 @@ coloredlogs.install(
 )
 logger = logging.getLogger(__name__)
 
+# Header row for the results sheet
+SHEET_HEADERS = [
+    'File ID',
+    'Filename',
+    'Created Time',
+    'Modified Time',
+    'Web View Link',
+    'Date',
+    'Dealership',
+    'Version',
+    'Campaign',
+    'Region',
+    'Model',
+    'Coupon Info',
+    'Processed Time'
+]
+
+# Sentinel telling the Sheets writer thread that no more rows are coming
+_END_OF_ROWS = object()
+
+# Upper bound on cells per Sheets batchUpdate, to stay clear of request size limits
+MAX_CELLS_PER_WRITE = 10000
+
+
+# Optional 'Sheet!' prefix, a start cell (row optional) and an optional ':end';
+# without a '!', more than three letters means a bare sheet name, not a column
+_A1_CELL = re.compile(r'^(?P<prefix>.+!)?(?P<column>[A-Za-z]{1,3})(?P<row>\d+)?(?::.*)?$')
+
+
+def _split_a1(range_name: str):
+    """
+    Split an A1 range into its sheet prefix, start column and start row.
+    
+    Args:
+        range_name: Range such as 'Sheet1!A1', 'Sheet1!A:M' or 'Sheet1'
+        
+    Returns:
+        Tuple of (sheet prefix including '!', column letters, row number);
+        a missing row defaults to 1 and a bare sheet name to A1
+    """
+    match = _A1_CELL.match(range_name)
+    if not match:
+        prefix = range_name if range_name.endswith('!') else f"{range_name}!"
+        return prefix, 'A', 1
+    row = match.group('row')
+    return match.group('prefix') or '', match.group('column'), int(row) if row else 1
+
 
 class DealershipProofAnalyzer:
     """Main application class for analyzing dealership proof documents."""
@@ -61,6 +114,17 @@ class DealershipProofAnalyzer:
         
         self.metadata_extractor = MetadataExtractor()
         
+        # Cache Vertex AI results so reruns skip files that haven't changed
+        self.coupon_cache = None
+        if Config.VERTEX_AI_CACHE_FILE:
+            try:
+                self.coupon_cache = CouponInfoCache(Config.VERTEX_AI_CACHE_FILE)
+            except sqlite3.Error as e:
+                logger.warning(f"Coupon info cache disabled, could not open {Config.VERTEX_AI_CACHE_FILE}: {e}")
+        
+        # Downloaded PDFs are cached once a run downloads them (see _get_pdf_cache)
+        self.pdf_cache = None
+        
         logger.info("All services initialized successfully")
     
     def crawl_drive_folder(self) -> List[Dict]:
@@ -74,162 +138,380 @@ class DealershipProofAnalyzer:
         
         files = self.drive_service.crawl_folder_structure(
             root_folder_id=Config.DRIVE_FOLDER_ID,
-            pdf_only=True
+            pdf_only=True,
+            max_workers=Config.MAX_WORKERS,
+            parents_per_query=Config.DRIVE_PARENTS_PER_QUERY,
+            path_glob=Config.DRIVE_PATH_GLOB or None
         )
         
         logger.info(f"Found {len(files)} PDF files")
         return files
     
-    def process_files(self, files: List[Dict], download_pdfs: bool = False) -> List[Dict]:
+    def _get_pdf_cache(self) -> Optional[PdfContentCache]:
         """
-        Process files to extract metadata and coupon information.
+        Open the PDF content cache, creating its directory on first use.
+        
+        Returns:
+            The cache, or None if it is disabled or can't be created
+        """
+        if self.pdf_cache is None and Config.PDF_CACHE_DIR:
+            try:
+                self.pdf_cache = PdfContentCache(Config.PDF_CACHE_DIR)
+            except OSError as e:
+                logger.warning(f"PDF cache disabled, could not open {Config.PDF_CACHE_DIR}: {e}")
+        return self.pdf_cache
+    
+    def _make_file_processor(self, download_pdfs: bool = False) -> Callable[[Dict], Optional[Dict]]:
+        """
+        Build the per-file processing function used by ``process_files``.
+        
+        Services, bound methods and settings are looked up once here and
+        captured by the returned closure, rather than re-resolved through
+        ``self`` and ``Config`` for every file.
         
         Args:
-            files: List of file metadata from Google Drive
             download_pdfs: If True, download PDF content for full analysis
             
         Returns:
-            List of processed results
+            Function that processes one file and returns its result, or
+            None if the file could not be processed
         """
-        logger.info(f"Processing {len(files)} files...")
-        results = []
+        extract_metadata = self.metadata_extractor.extract_all_metadata
+        download = self.drive_service.download_file_content
+        extract_coupon_info = self.vertex_ai_service.extract_coupon_info
+        coupon_cache = self.coupon_cache
+        pdf_cache = self._get_pdf_cache() if download_pdfs else None
+        model_name = Config.VERTEX_AI_MODEL
+        temperature = Config.VERTEX_AI_TEMPERATURE
+        max_output_tokens = Config.VERTEX_AI_MAX_OUTPUT_TOKENS
+        now = datetime.now
         
-        for idx, file_info in enumerate(files):
+        def process_one(file_info: Dict) -> Optional[Dict]:
             try:
-                logger.info(f"Processing file {idx + 1}/{len(files)}: {file_info['name']}")
+                filename = file_info['name']
                 
                 # Extract metadata from filename/path
-                metadata = self.metadata_extractor.extract_all_metadata(file_info)
-                
-                # Prepare data for Vertex AI
-                file_data = {
-                    'filename': file_info['name'],
-                    'metadata': metadata
-                }
+                metadata = extract_metadata(file_info)
                 
                 # Optionally download PDF content for full analysis
+                pdf_content = None
                 if download_pdfs:
+                    file_id = file_info['id']
+                    modified_time = file_info.get('modifiedTime')
+                    if pdf_cache is not None and modified_time:
+                        try:
+                            pdf_content = pdf_cache.get(file_id, modified_time)
+                        except OSError as e:
+                            logger.warning(f"Could not read cached PDF {filename}: {e}")
+                    
+                    if pdf_content is not None:
+                        logger.debug(f"Using cached PDF content for {filename}")
+                    else:
+                        try:
+                            pdf_content = download(file_id)
+                            logger.debug(f"Downloaded PDF content for {filename}")
+                        except Exception as e:
+                            logger.warning(f"Could not download PDF {filename}: {e}")
+                        else:
+                            if pdf_cache is not None and modified_time:
+                                try:
+                                    pdf_cache.set(file_id, modified_time, pdf_content)
+                                except OSError as e:
+                                    # The download itself is fine; just don't cache it
+                                    logger.warning(f"Could not cache PDF {filename}: {e}")
+                
+                # Reuse a cached result when nothing about the request changed
+                cache_key = None
+                coupon_info = None
+                if coupon_cache is not None:
+                    cache_key = coupon_cache.make_key(
+                        filename,
+                        metadata,
+                        pdf_content,
+                        model=model_name,
+                        temperature=temperature,
+                        max_output_tokens=max_output_tokens
+                    )
                     try:
-                        pdf_content = self.drive_service.download_file_content(file_info['id'])
-                        file_data['pdf_content'] = pdf_content
-                        logger.debug(f"Downloaded PDF content for {file_info['name']}")
-                    except Exception as e:
-                        logger.warning(f"Could not download PDF {file_info['name']}: {e}")
+                        coupon_info = coupon_cache.get(cache_key)
+                    except sqlite3.Error as e:
+                        # A locked or corrupt cache is just a miss
+                        logger.warning(f"Could not read cached coupon info for {filename}: {e}")
                 
-                # Extract coupon information using Vertex AI
-                coupon_info = self.vertex_ai_service.extract_coupon_info(
-                    filename=file_data['filename'],
-                    metadata=file_data['metadata'],
-                    pdf_content=file_data.get('pdf_content'),
-                    temperature=Config.VERTEX_AI_TEMPERATURE,
-                    max_output_tokens=Config.VERTEX_AI_MAX_OUTPUT_TOKENS
-                )
+                if coupon_info is not None:
+                    logger.debug(f"Using cached coupon info for {filename}")
+                else:
+                    # Extract coupon information using Vertex AI
+                    coupon_info = extract_coupon_info(
+                        filename=filename,
+                        metadata=metadata,
+                        pdf_content=pdf_content,
+                        temperature=temperature,
+                        max_output_tokens=max_output_tokens
+                    )
+                    if cache_key is not None:
+                        try:
+                            coupon_cache.set(cache_key, coupon_info)
+                        except sqlite3.Error as e:
+                            logger.warning(f"Could not cache coupon info for {filename}: {e}")
                 
                 # Combine all information
-                result = {
+                return {
                     'file_id': file_info['id'],
-                    'filename': file_info['name'],
+                    'filename': filename,
                     'created_time': file_info.get('createdTime', ''),
                     'modified_time': file_info.get('modifiedTime', ''),
                     'web_view_link': file_info.get('webViewLink', ''),
                     'metadata': metadata,
                     'coupon_info': coupon_info,
-                    'processed_time': datetime.now().isoformat()
+                    'processed_time': now().isoformat()
                 }
                 
-                results.append(result)
-                
-                # Log progress periodically
-                if (idx + 1) % 10 == 0:
-                    logger.info(f"Processed {idx + 1}/{len(files)} files")
-                
             except Exception as e:
                 logger.error(f"Error processing file {file_info.get('name', 'unknown')}: {e}")
-                # Continue with next file
-                continue
+                return None
         
-        logger.info(f"Successfully processed {len(results)} files")
-        return results
+        return process_one
     
-    def write_results_to_sheets(self, results: List[Dict]):
+    def process_files(self, files: List[Dict], download_pdfs: bool = False) -> Iterator[Dict]:
         """
-        Write results to Google Sheets.
+        Process files to extract metadata and coupon information.
+        
+        Files are processed concurrently on up to ``MAX_WORKERS`` threads,
+        since each one waits on Drive downloads and Vertex AI calls.
+        Results are yielded as soon as each file completes, so callers can
+        start writing them before the whole batch is done. At most
+        ``2 * MAX_WORKERS`` files are in flight at once, and closing the
+        generator early cancels files that haven't started.
         
         Args:
-            results: List of processed results
+            files: List of file metadata from Google Drive
+            download_pdfs: If True, download PDF content for full analysis
+            
+        Yields:
+            Processed results, in completion order
         """
-        if not results:
-            logger.warning("No results to write to Google Sheets")
-            return
-        
-        logger.info(f"Writing {len(results)} results to Google Sheets...")
-        
-        # Prepare header row
-        headers = [
-            'File ID',
-            'Filename',
-            'Created Time',
-            'Modified Time',
-            'Web View Link',
-            'Date',
-            'Dealership',
-            'Version',
-            'Campaign',
-            'Region',
-            'Model',
-            'Coupon Info',
-            'Processed Time'
+        total = len(files)
+        logger.info(f"Processing {total} files...")
+        processed = 0
+        
+        # Report progress about 100 times per run, however large it is
+        progress_every = max(1, total // 100)
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        
+        process_one = self._make_file_processor(download_pdfs)
+        
+        # Keep only a couple of files per worker in flight, so results don't
+        # pile up and an interrupted run doesn't leave a long queue to drain
+        max_in_flight = Config.MAX_WORKERS * 2
+        queued = enumerate(files, start=1)
+        pending = set()
+        completed = 0
+        finished = False
+        
+        executor = ThreadPoolExecutor(max_workers=Config.MAX_WORKERS)
+        submit = executor.submit
+        try:
+            while True:
+                for idx, file_info in islice(queued, max_in_flight - len(pending)):
+                    if debug_enabled:
+                        logger.debug(f"Queued file {idx}/{total}: {file_info['name']}")
+                    pending.add(submit(process_one, file_info))
+                if not pending:
+                    break
+                
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    completed += 1
+                    result = future.result()
+                    if result is not None:
+                        processed += 1
+                        yield result
+                    
+                    # Log progress periodically
+                    if completed % progress_every == 0:
+                        logger.info(f"Processed {completed}/{total} files")
+            finished = True
+        finally:
+            if not finished:
+                # Closed early (Ctrl-C, writer failure): don't start queued files
+                for future in pending:
+                    future.cancel()
+            executor.shutdown(wait=finished)
+        
+        logger.info(f"Successfully processed {processed} files")
+    
+    def _result_to_row(self, result: Dict) -> List[Any]:
+        """
+        Convert a processed result into a Sheets row.
+        
+        Args:
+            result: Processed result
+            
+        Returns:
+            Row values in SHEET_HEADERS order
+        """
+        metadata = result.get('metadata', {})
+        
+        # Serialize parsed coupon info; plain-text answers are written as-is
+        coupon_info = result.get('coupon_info', '')
+        if isinstance(coupon_info, str):
+            coupon_info = parse_coupon_info(coupon_info)
+        if isinstance(coupon_info, str):
+            coupon_info_display = coupon_info
+        else:
+            coupon_info_display = dumps_coupon_info(coupon_info)
+        
+        return [
+            result.get('file_id', ''),
+            result.get('filename', ''),
+            result.get('created_time', ''),
+            result.get('modified_time', ''),
+            result.get('web_view_link', ''),
+            metadata.get('date', ''),
+            metadata.get('dealership', ''),
+            metadata.get('version', ''),
+            metadata.get('campaign', ''),
+            metadata.get('region', ''),
+            metadata.get('model', ''),
+            coupon_info_display,
+            result.get('processed_time', '')
         ]
+    
+    def _next_data_row(self, prefix: str, column: str, header_row: int) -> int:
+        """
+        Find the first free row below any existing results.
         
-        # Write header
-        self.sheets_service.write_header(
+        Args:
+            prefix: Sheet prefix including '!'
+            column: Start column of the results table
+            header_row: Row number of the header
+            
+        Returns:
+            Row number where new results should be written
+        """
+        existing = self.sheets_service.get_values(
             spreadsheet_id=Config.SHEETS_SPREADSHEET_ID,
-            range_name=Config.SHEETS_RANGE,
-            headers=headers
+            range_name=f"{prefix}{column}{header_row}:{column}"
         )
+        return header_row + max(len(existing), 1)
+    
+    def _drain_rows(self, row_queue: queue.Queue, errors: List[Exception]):
+        """
+        Write queued rows to Google Sheets until the end sentinel arrives.
         
-        # Prepare data rows
-        rows = []
-        for result in results:
-            metadata = result.get('metadata', {})
-            
-            # Parse coupon info if it's JSON
-            coupon_info_str = result.get('coupon_info', '')
-            try:
-                coupon_info_json = json.loads(coupon_info_str)
-                coupon_info_display = json.dumps(coupon_info_json, indent=2)
-            except:
-                coupon_info_display = coupon_info_str
+        Runs on a background thread. Rows are flushed every ``BATCH_SIZE``
+        rows; rows that queued up in the meantime are folded into the same
+        flush, and the header is fused into the first write. Each flush is
+        sent as batchUpdate calls of at most ``MAX_CELLS_PER_WRITE`` cells.
+        
+        Args:
+            row_queue: Queue of rows, terminated by _END_OF_ROWS
+            errors: List that receives any exception raised while writing
+        """
+        prefix, column, header_row = _split_a1(Config.SHEETS_RANGE)
+        # Leave room for the header row, which shares the first write
+        rows_per_write = max(1, MAX_CELLS_PER_WRITE // len(SHEET_HEADERS) - 1)
+        max_rows = max(Config.BATCH_SIZE, rows_per_write)
+        next_row = None
+        batch = []
+        batch_number = 0
+        finished = False
+        
+        try:
+            while not finished:
+                row = row_queue.get()
+                if row is _END_OF_ROWS:
+                    finished = True
+                else:
+                    batch.append(row)
+                
+                if not finished and len(batch) < Config.BATCH_SIZE:
+                    continue
+                
+                # Fold in rows that arrived while the last write was in flight
+                while not finished and len(batch) < max_rows:
+                    try:
+                        row = row_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if row is _END_OF_ROWS:
+                        finished = True
+                    else:
+                        batch.append(row)
+                
+                if not batch:
+                    continue
+                
+                for start in range(0, len(batch), rows_per_write):
+                    rows = batch[start:start + rows_per_write]
+                    if next_row is None:
+                        next_row = self._next_data_row(prefix, column, header_row)
+                        self.sheets_service.write_header_and_rows(
+                            spreadsheet_id=Config.SHEETS_SPREADSHEET_ID,
+                            header_range=Config.SHEETS_RANGE,
+                            headers=SHEET_HEADERS,
+                            data_range=f"{prefix}{column}{next_row}",
+                            rows=rows
+                        )
+                    else:
+                        self.sheets_service.batch_update_values(
+                            spreadsheet_id=Config.SHEETS_SPREADSHEET_ID,
+                            data=[{'range': f"{prefix}{column}{next_row}", 'values': rows}]
+                        )
+                    next_row += len(rows)
+                batch_number += 1
+                logger.info(f"Written batch {batch_number}: {len(batch)} rows")
+                batch = []
+        except Exception as e:
+            errors.append(e)
+    
+    def write_results_to_sheets(self, results: Iterable[Dict]) -> int:
+        """
+        Write results to Google Sheets.
+        
+        Rows are handed to a background writer thread as results arrive,
+        so Sheets writes overlap with file processing when ``results`` is
+        the generator returned by ``process_files``.
+        
+        Args:
+            results: Processed results
             
-            row = [
-                result.get('file_id', ''),
-                result.get('filename', ''),
-                result.get('created_time', ''),
-                result.get('modified_time', ''),
-                result.get('web_view_link', ''),
-                metadata.get('date', ''),
-                metadata.get('dealership', ''),
-                metadata.get('version', ''),
-                metadata.get('campaign', ''),
-                metadata.get('region', ''),
-                metadata.get('model', ''),
-                coupon_info_display,
-                result.get('processed_time', '')
-            ]
-            rows.append(row)
-        
-        # Write data in batches
-        batch_size = Config.BATCH_SIZE
-        for i in range(0, len(rows), batch_size):
-            batch = rows[i:i + batch_size]
-            self.sheets_service.append_rows(
-                spreadsheet_id=Config.SHEETS_SPREADSHEET_ID,
-                range_name=Config.SHEETS_RANGE,
-                rows=batch
-            )
-            logger.info(f"Written batch {i // batch_size + 1}: {len(batch)} rows")
-        
-        logger.info("Successfully written all results to Google Sheets")
+        Returns:
+            Number of rows written
+        """
+        logger.info("Writing results to Google Sheets...")
+        
+        row_queue = queue.Queue()
+        writer_errors = []
+        writer = threading.Thread(target=self._drain_rows, args=(row_queue, writer_errors), daemon=True)
+        writer.start()
+        
+        row_count = 0
+        try:
+            for result in results:
+                if writer_errors:
+                    break
+                row_queue.put(self._result_to_row(result))
+                row_count += 1
+        finally:
+            # Stop a process_files generator now rather than when it's collected,
+            # so files still queued behind a failed writer are cancelled
+            close = getattr(results, 'close', None)
+            if close is not None:
+                close()
+            row_queue.put(_END_OF_ROWS)
+            writer.join()
+        
+        if writer_errors:
+            raise writer_errors[0]
+        
+        if not row_count:
+            logger.warning("No results to write to Google Sheets")
+            return 0
+        
+        logger.info(f"Successfully written all {row_count} results to Google Sheets")
+        return row_count
     
     def run(self, download_pdfs: bool = False):
         """
@@ -250,15 +532,13 @@ class DealershipProofAnalyzer:
                 logger.warning("No PDF files found in the specified Drive folder")
                 return
             
-            # Step 2: Process files
+            # Step 2 & 3: Process files and stream results to Google Sheets
             results = self.process_files(files, download_pdfs=download_pdfs)
-            
-            # Step 3: Write results to Google Sheets
-            self.write_results_to_sheets(results)
+            processed_count = self.write_results_to_sheets(results)
             
             logger.info("="*80)
             logger.info("Analysis complete!")
-            logger.info(f"Total files processed: {len(results)}")
+            logger.info(f"Total files processed: {processed_count}")
             logger.info("="*80)
             
         except KeyboardInterrupt:
@@ -267,6 +547,9 @@ class DealershipProofAnalyzer:
         except Exception as e:
             logger.error(f"Fatal error during analysis: {e}", exc_info=True)
             sys.exit(1)
+        finally:
+            if self.coupon_cache is not None:
+                self.coupon_cache.close()
 
 
 def main():
@@ -1,13 +1,57 @@
 """
 Metadata extractor for Direct Mail PDF proofs.
 """
+import functools
 import re
 import logging
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Every date format _parse_date understands, tried in order for unusual shapes
+DATE_FORMATS = (
+    '%Y-%m-%d',
+    '%Y_%m_%d',
+    '%m-%d-%Y',
+    '%m_%d_%Y',
+    '%Y%m%d',
+)
+
+
+def _candidate_date_formats(date_str: str) -> tuple:
+    """Pick the date formats worth trying based on the string's shape."""
+    if len(date_str) == 8 and date_str.isdigit():
+        return ('%Y%m%d',)
+    if len(date_str) > 4 and date_str[:4].isdigit():
+        if date_str[4] == '-':
+            return ('%Y-%m-%d',)
+        if date_str[4] == '_':
+            return ('%Y_%m_%d',)
+    if '-' in date_str:
+        return ('%m-%d-%Y',)
+    if '_' in date_str:
+        return ('%m_%d_%Y',)
+    return DATE_FORMATS
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_date_string(date_str: str) -> Optional[str]:
+    """
+    Parse a date string into ISO format (YYYY-MM-DD).
+    
+    The string's shape selects the format up front, so a typical date
+    costs a single strptime call instead of a chain of failing ones.
+    """
+    for fmt in _candidate_date_formats(date_str):
+        try:
+            return datetime.strptime(date_str, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    
+    logger.warning(f"Could not parse date: {date_str}")
+    return None
+
 
 class MetadataExtractor:
     """Extract metadata from PDF filenames and paths using regex patterns."""
@@ -48,11 +92,68 @@ class MetadataExtractor:
         ],
     }
     
+    # Folder name patterns used by extract_from_path
+    PATH_PATTERNS = {
+        'year_folder': r'^\d{4}$',
+        'month_folder': r'^(\d{1,2})[-_]?([A-Za-z]+)?$',
+    }
+    
+    # Starting point for extract_from_filename results
+    _EMPTY_METADATA = {
+        'filename': None,
+        'date': None,
+        'dealership': None,
+        'version': None,
+        'campaign': None,
+        'region': None,
+        'model': None,
+    }
+    
+    # Patterns are compiled once when the class is defined and shared by
+    # every instance
+    COMPILED_PATTERNS = {
+        key: [re.compile(p, re.IGNORECASE) for p in patterns]
+        for key, patterns in PATTERNS.items()
+    }
+    
+    # Bound search methods per category, in priority order
+    _searchers = tuple(
+        (key, tuple(pattern.search for pattern in patterns))
+        for key, patterns in COMPILED_PATTERNS.items()
+    )
+    _field_names = tuple(COMPILED_PATTERNS)
+    _dealership_searchers = dict(_searchers)['dealership']
+    _year_re = re.compile(PATH_PATTERNS['year_folder'])
+    _month_re = re.compile(PATH_PATTERNS['month_folder'])
+    
     def __init__(self):
         """Initialize metadata extractor."""
-        self.compiled_patterns = {}
-        for key, patterns in self.PATTERNS.items():
-            self.compiled_patterns[key] = [re.compile(p, re.IGNORECASE) for p in patterns]
+        self.compiled_patterns = self.COMPILED_PATTERNS
+        
+        # Filename stems repeat across revisions and folders, so cache the regex work
+        self._match_filename = functools.lru_cache(maxsize=4096)(self._match_filename_uncached)
+    
+    def _match_filename_uncached(self, name_without_ext: str) -> Tuple[Optional[str], ...]:
+        """
+        Run every category's patterns against a filename stem.
+        
+        Args:
+            name_without_ext: Filename with its extension removed
+            
+        Returns:
+            Tuple with the first match per category, in PATTERNS order
+        """
+        values = []
+        for key, searchers in self._searchers:
+            value = None
+            for search in searchers:
+                match = search(name_without_ext)
+                if match:
+                    value = match.group(1)
+                    logger.debug("Found %s: %s in %s", key, value, name_without_ext)
+                    break  # Use first match for each category
+            values.append(value)
+        return tuple(values)
     
     def extract_from_filename(self, filename: str) -> Dict:
         """
@@ -64,27 +165,14 @@ class MetadataExtractor:
         Returns:
             Dictionary with extracted metadata
         """
-        metadata = {
-            'filename': filename,
-            'date': None,
-            'dealership': None,
-            'version': None,
-            'campaign': None,
-            'region': None,
-            'model': None,
-        }
+        metadata = self._EMPTY_METADATA.copy()
+        metadata['filename'] = filename
         
         # Remove file extension
         name_without_ext = filename.rsplit('.', 1)[0]
         
         # Try each pattern type
-        for key, patterns in self.compiled_patterns.items():
-            for pattern in patterns:
-                match = pattern.search(name_without_ext)
-                if match:
-                    metadata[key] = match.group(1)
-                    logger.debug(f"Found {key}: {metadata[key]} in {filename}")
-                    break  # Use first match for each category
+        metadata.update(zip(self._field_names, self._match_filename(name_without_ext)))
         
         # Parse date if found
         if metadata['date']:
@@ -102,32 +190,37 @@ class MetadataExtractor:
         Returns:
             Dictionary with extracted metadata
         """
+        path_parts = file_path.split('/')
+        
         # Get filename metadata first
-        filename = file_path.split('/')[-1]
-        metadata = self.extract_from_filename(filename)
+        metadata = self.extract_from_filename(path_parts[-1])
         
         # Add path information
         metadata['full_path'] = file_path
-        path_parts = file_path.split('/')
         metadata['path_depth'] = len(path_parts)
         
+        match_year = self._year_re.match
+        match_month = self._month_re.match
+        find_dealership = not metadata['dealership']
+        
         # Try to extract additional info from folder names
         for part in path_parts[:-1]:  # Exclude filename
-            # Check for year folders
-            if re.match(r'^\d{4}$', part):
+            # Check for year folders (a year can't also be a month folder)
+            if match_year(part):
                 metadata['year_folder'] = part
+            else:
+                # Check for month folders
+                month_match = match_month(part)
+                if month_match:
+                    metadata['month_folder'] = month_match.group(1)
             
-            # Check for month folders
-            month_match = re.match(r'^(\d{1,2})[-_]?([A-Za-z]+)?$', part)
-            if month_match:
-                metadata['month_folder'] = month_match.group(1)
-            
-            # Check for dealership in path
-            if not metadata['dealership']:
-                for pattern in self.compiled_patterns['dealership']:
-                    match = pattern.search(part)
+            # Check for dealership in path until one is found
+            if find_dealership:
+                for search in self._dealership_searchers:
+                    match = search(part)
                     if match:
                         metadata['dealership'] = match.group(1)
+                        find_dealership = False
                         break
         
         return metadata
@@ -142,24 +235,7 @@ class MetadataExtractor:
         Returns:
             ISO format date string (YYYY-MM-DD) or None
         """
-        # Try different date formats
-        formats = [
-            '%Y-%m-%d',
-            '%Y_%m_%d',
-            '%m-%d-%Y',
-            '%m_%d_%Y',
-            '%Y%m%d',
-        ]
-        
-        for fmt in formats:
-            try:
-                parsed = datetime.strptime(date_str, fmt)
-                return parsed.strftime('%Y-%m-%d')
-            except ValueError:
-                continue
-        
-        logger.warning(f"Could not parse date: {date_str}")
-        return None
+        return _parse_date_string(date_str)
     
     def extract_all_metadata(self, file_info: Dict) -> Dict:
         """
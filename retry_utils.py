@@ -0,0 +1,202 @@
+"""
+Retry policies shared by the Google API services.
+"""
+import functools
+import json
+import logging
+import math
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on a server-requested delay, so a bogus header can't stall a run
+MAX_RETRY_AFTER = 120
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Drive reports per-user and per-project rate limits as 403s with these
+# reasons, in the legacy errors[] list or as a google.rpc ErrorInfo reason
+RATE_LIMIT_REASONS = frozenset({'rateLimitExceeded', 'userRateLimitExceeded', 'RATE_LIMIT_EXCEEDED'})
+
+
+def _parse_retry_after(value: str) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date."""
+    try:
+        delay = float(value)
+    except ValueError:
+        pass
+    else:
+        # float() also accepts 'nan' and 'inf', which no wait can honour
+        return delay if math.isfinite(delay) else None
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return (retry_at - datetime.now(timezone.utc)).total_seconds()
+
+
+def _parse_retry_delay(content: bytes) -> Optional[float]:
+    """Read google.rpc.RetryInfo's retryDelay (e.g. '2.5s') from an error body."""
+    try:
+        details = json.loads(content)['error'].get('details', [])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+    for detail in details:
+        delay = detail.get('retryDelay') if isinstance(detail, dict) else None
+        if isinstance(delay, str) and delay.endswith('s'):
+            try:
+                seconds = float(delay[:-1])
+            except ValueError:
+                return None
+            return seconds if math.isfinite(seconds) else None
+    return None
+
+
+def _error_reasons(error) -> set:
+    """Collect the reasons an HttpError gives, from both error body formats."""
+    # googleapiclient fills error_details from google.rpc details when the
+    # body has them, hiding the legacy errors[] reasons, so read both
+    details = error.error_details if isinstance(error.error_details, list) else []
+    try:
+        details = details + json.loads(error.content)['error'].get('errors', [])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return {detail.get('reason') for detail in details if isinstance(detail, dict)}
+
+
+def server_retry_delay(error: BaseException) -> Optional[float]:
+    """
+    Get the delay the server asked for before retrying, if any.
+
+    Args:
+        error: Exception raised by an API call
+
+    Returns:
+        Delay in seconds, or None if the server didn't specify one
+    """
+    from googleapiclient.errors import HttpError
+
+    if not isinstance(error, HttpError):
+        return None
+
+    delay = None
+    header = error.resp.get('retry-after') if error.resp is not None else None
+    if header:
+        delay = _parse_retry_after(header)
+    if delay is None:
+        delay = _parse_retry_delay(error.content)
+    if delay is None:
+        return None
+    return min(max(delay, 0.0), MAX_RETRY_AFTER)
+
+
+@functools.lru_cache(maxsize=None)
+def _fallback_wait():
+    """Jittered exponential backoff used when the server gives no delay."""
+    from tenacity import wait_exponential_jitter
+    return wait_exponential_jitter(initial=1, max=16)
+
+
+def wait_retry_after(retry_state) -> float:
+    """Tenacity wait strategy honouring Retry-After, else jittered exponential backoff."""
+    error = retry_state.outcome.exception()
+    delay = server_retry_delay(error) if error is not None else None
+    if delay is not None:
+        logger.info(f"Server requested retry in {delay:.1f}s")
+        return delay
+    return _fallback_wait()(retry_state)
+
+
+def lazy_retry(make_policy: Callable[[], Dict[str, Any]], is_retryable: Callable[[BaseException], bool]):
+    """
+    Decorator retrying transient failures with tenacity, off the success path.
+
+    The wrapped function is called directly first, so a call that succeeds
+    costs no tenacity machinery and tenacity isn't even imported. When it
+    raises an error ``is_retryable`` accepts, the policy is built and the
+    failed attempt is handed to it, so waits and attempt counts match a
+    plain ``@retry``.
+
+    Args:
+        make_policy: Function returning tenacity.Retrying keyword arguments
+            (stop, wait, ...), called on the first retry
+        is_retryable: Predicate selecting the exceptions worth retrying
+
+    Returns:
+        Decorator applying the policy to a function
+    """
+    def decorator(func):
+        retrying = None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            nonlocal retrying
+            try:
+                return func(*args, **kwargs)
+            except Exception as error:
+                if not is_retryable(error):
+                    raise
+                first_error = error
+
+            if retrying is None:
+                from tenacity import Retrying, retry_if_exception
+                retrying = Retrying(retry=retry_if_exception(is_retryable), **make_policy())
+
+            pending = [first_error]
+
+            def attempt():
+                # Replay the failure already seen as attempt 1, so it is waited
+                # on and counted like any other
+                if pending:
+                    raise pending.pop()
+                return func(*args, **kwargs)
+
+            return retrying.copy()(attempt)
+
+        return wrapper
+
+    return decorator
+
+
+def is_retryable_http_error(error: BaseException) -> bool:
+    """
+    Check whether a Drive/Sheets failure is transient and worth retrying.
+    
+    Args:
+        error: Exception raised by an API call
+    
+    Returns:
+        True for rate limiting, 5xx responses and transport failures
+    """
+    import httplib2
+    from googleapiclient.errors import HttpError
+
+    if isinstance(error, HttpError):
+        status = error.resp.status if error.resp is not None else None
+        if status in RETRYABLE_STATUSES:
+            return True
+        if status == 403:
+            return not RATE_LIMIT_REASONS.isdisjoint(_error_reasons(error))
+        return False
+    return isinstance(error, (httplib2.HttpLib2Error, OSError))
+
+
+def _http_retry_policy() -> Dict[str, Any]:
+    """Retry policy for Drive and Sheets calls."""
+    from tenacity import stop_after_attempt
+
+    # Waits are as long as the server asks when it says so
+    return {
+        'stop': stop_after_attempt(5),
+        'wait': wait_retry_after,
+        'reraise': True
+    }
+
+
+# Only transient failures are retried; other errors surface immediately
+http_retry = lazy_retry(_http_retry_policy, is_retryable_http_error)
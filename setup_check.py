@@ -3,94 +3,168 @@
 Setup script for the Dealership Proof Analyzer.
 Helps users set up the environment and verify configuration.
 """
+import functools
+import importlib.metadata
+import importlib.util
 import os
+import re
 import sys
 from pathlib import Path
 
+# Distribution name -> top-level module it installs
+PACKAGE_MODULES = {
+    'google-auth': 'google.auth',
+    'google-auth-oauthlib': 'google_auth_oauthlib',
+    'google-auth-httplib2': 'google_auth_httplib2',
+    'google-api-python-client': 'googleapiclient',
+    'google-cloud-aiplatform': 'google.cloud.aiplatform',
+    'python-dotenv': 'dotenv',
+    'coloredlogs': 'coloredlogs',
+    'tenacity': 'tenacity',
+}
 
-def check_file_exists(filepath, description):
-    """Check if a file exists."""
-    if os.path.exists(filepath):
-        print(f"✓ {description}: {filepath}")
+
+def list_present_files(directory='.'):
+    """List the names in a directory with one scandir pass."""
+    with os.scandir(directory) as entries:
+        return {entry.name for entry in entries}
+
+
+def check_file_exists(filepath, description, present=None, say=print):
+    """Check if a file exists, using a precomputed set of names when given."""
+    if present is not None and '/' not in filepath and os.sep not in filepath:
+        exists = filepath in present
+    else:
+        exists = os.path.exists(filepath)
+    if exists:
+        say(f"✓ {description}: {filepath}")
         return True
     else:
-        print(f"✗ {description} not found: {filepath}")
+        say(f"✗ {description} not found: {filepath}")
         return False
 
 
-def check_env_variable(var_name):
-    """Check if an environment variable is set."""
-    value = os.getenv(var_name)
+def load_env_file(filepath):
+    """Parse KEY=VALUE lines from an env file in a single read."""
+    text = Path(filepath).read_text(encoding='utf-8', errors='replace')
+    pairs = (
+        line.split('=', 1) for line in text.splitlines()
+        if line.strip() and not line.lstrip().startswith('#') and '=' in line
+    )
+    return {key.strip(): value.strip() for key, value in pairs}
+
+
+def check_env_variable(var_name, env=None, say=print):
+    """Check if an environment variable is set, preferring values from env."""
+    if env is not None and var_name in env:
+        value = env[var_name]
+    else:
+        value = os.getenv(var_name)
     if value:
-        print(f"✓ {var_name}: Set")
+        say(f"✓ {var_name}: Set")
         return True
     else:
-        print(f"✗ {var_name}: Not set")
+        say(f"✗ {var_name}: Not set")
+        return False
+
+
+def is_module_available(module_name):
+    """Check if a module can be imported, without executing it."""
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except ModuleNotFoundError:
+        # A parent package is missing
         return False
 
 
+def _normalize_name(name):
+    """Normalize a distribution name as in PEP 503."""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+@functools.lru_cache(maxsize=None)
+def _installed_versions():
+    """Map every installed distribution to its version, in one sys.path scan."""
+    versions = {}
+    for dist in importlib.metadata.distributions():
+        name = dist.metadata['Name']
+        if name:
+            versions.setdefault(_normalize_name(name), dist.version)
+    return versions
+
+
+def get_package_version(package):
+    """Get the installed version of a distribution, or None."""
+    return _installed_versions().get(_normalize_name(package))
+
+
 def main():
     """Run setup checks."""
-    print("="*80)
-    print("Dealership Proof Analyzer - Setup Verification")
-    print("="*80)
-    print()
+    # Collect the report and write it once at the end
+    out = []
+    say = out.append
+    
+    say("="*80)
+    say("Dealership Proof Analyzer - Setup Verification")
+    say("="*80)
+    say('')
     
     all_checks_passed = True
     
+    # One directory read instead of a stat() per checked file
+    present = list_present_files()
+    
     # Check Python version
-    print("Python Version Check:")
+    say("Python Version Check:")
     version = sys.version_info
-    print(f"  Python {version.major}.{version.minor}.{version.micro}")
+    say(f"  Python {version.major}.{version.minor}.{version.micro}")
     if version.major >= 3 and version.minor >= 8:
-        print("  ✓ Python version is 3.8 or higher")
+        say("  ✓ Python version is 3.8 or higher")
     else:
-        print("  ✗ Python version must be 3.8 or higher")
+        say("  ✗ Python version must be 3.8 or higher")
         all_checks_passed = False
-    print()
+    say('')
     
     # Check required files
-    print("Required Files Check:")
+    say("Required Files Check:")
     files_to_check = [
         ('requirements.txt', 'Requirements file'),
         ('.env.example', 'Environment example file'),
         ('config.py', 'Configuration module'),
+        ('auth.py', 'Authentication module'),
+        ('retry_utils.py', 'Retry policy module'),
         ('main.py', 'Main application'),
         ('drive_service.py', 'Drive service module'),
         ('sheets_service.py', 'Sheets service module'),
         ('vertex_ai_service.py', 'Vertex AI service module'),
         ('metadata_extractor.py', 'Metadata extractor module'),
+        ('local_cache.py', 'Local cache module'),
     ]
     
     for filepath, description in files_to_check:
-        if not check_file_exists(filepath, description):
+        if not check_file_exists(filepath, description, present, say):
             all_checks_passed = False
-    print()
+    say('')
     
     # Check for credentials file
-    print("Credentials Check:")
-    if check_file_exists('credentials.json', 'Google OAuth credentials'):
-        print("  ✓ OAuth credentials found")
+    say("Credentials Check:")
+    if check_file_exists('credentials.json', 'Google OAuth credentials', present, say):
+        say("  ✓ OAuth credentials found")
     else:
-        print("  ✗ OAuth credentials not found")
-        print("  → Download from Google Cloud Console and save as credentials.json")
+        say("  ✗ OAuth credentials not found")
+        say("  → Download from Google Cloud Console and save as credentials.json")
         all_checks_passed = False
-    print()
+    say('')
     
     # Check for .env file
-    print("Environment Configuration Check:")
-    if check_file_exists('.env', 'Environment configuration'):
-        print("  ✓ Environment file found")
-        print("  Checking required variables:")
+    say("Environment Configuration Check:")
+    if check_file_exists('.env', 'Environment configuration', present, say):
+        say("  ✓ Environment file found")
+        say("  Checking required variables:")
         
         # Load .env file manually
-        if os.path.exists('.env'):
-            with open('.env', 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#') and '=' in line:
-                        key, value = line.split('=', 1)
-                        os.environ[key] = value
+        env = load_env_file('.env')
+        os.environ.update(env)
         
         required_vars = [
             'GCP_PROJECT_ID',
@@ -99,60 +173,52 @@ def main():
         ]
         
         for var in required_vars:
-            if not check_env_variable(var):
+            if not check_env_variable(var, env, say):
                 all_checks_passed = False
     else:
-        print("  ✗ Environment file not found")
-        print("  → Copy .env.example to .env and fill in your configuration")
+        say("  ✗ Environment file not found")
+        say("  → Copy .env.example to .env and fill in your configuration")
         all_checks_passed = False
-    print()
+    say('')
     
     # Check Python packages
-    print("Python Packages Check:")
-    required_packages = [
-        'google-auth',
-        'google-api-python-client',
-        'google-cloud-aiplatform',
-        'python-dotenv',
-        'coloredlogs',
-        'tenacity'
-    ]
-    
+    say("Python Packages Check:")
     missing_packages = []
-    for package in required_packages:
-        try:
-            __import__(package.replace('-', '_'))
-            print(f"  ✓ {package}")
-        except ImportError:
-            print(f"  ✗ {package}")
+    for package, module_name in PACKAGE_MODULES.items():
+        if is_module_available(module_name):
+            version = get_package_version(package)
+            say(f"  ✓ {package}" + (f" ({version})" if version else ""))
+        else:
+            say(f"  ✗ {package}")
             missing_packages.append(package)
             all_checks_passed = False
     
     if missing_packages:
-        print()
-        print("  Missing packages detected. Install with:")
-        print("  pip install -r requirements.txt")
-    print()
+        say('')
+        say("  Missing packages detected. Install with:")
+        say("  pip install -r requirements.txt")
+    say('')
     
     # Final summary
-    print("="*80)
+    say("="*80)
     if all_checks_passed:
-        print("✓ All checks passed! You're ready to run the analyzer.")
-        print()
-        print("To run the analyzer:")
-        print("  python main.py")
-        print()
-        print("For full PDF analysis:")
-        print("  python main.py --download-pdfs")
+        say("✓ All checks passed! You're ready to run the analyzer.")
+        say('')
+        say("To run the analyzer:")
+        say("  python main.py")
+        say('')
+        say("For full PDF analysis:")
+        say("  python main.py --download-pdfs")
     else:
-        print("✗ Some checks failed. Please fix the issues above before running.")
-        print()
-        print("Setup steps:")
-        print("1. Copy .env.example to .env and configure it")
-        print("2. Download OAuth credentials from Google Cloud Console")
-        print("3. Install required packages: pip install -r requirements.txt")
-    print("="*80)
+        say("✗ Some checks failed. Please fix the issues above before running.")
+        say('')
+        say("Setup steps:")
+        say("1. Copy .env.example to .env and configure it")
+        say("2. Download OAuth credentials from Google Cloud Console")
+        say("3. Install required packages: pip install -r requirements.txt")
+    say("="*80)
     
+    sys.stdout.write('\n'.join(out) + '\n')
     return 0 if all_checks_passed else 1
 
 
@@ -2,17 +2,55 @@
 Google Sheets service for writing results.
 """
 import logging
-from typing import List, Dict, Any
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from tenacity import retry, stop_after_attempt, wait_exponential
-import os
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, List, Dict, Any, Optional, Tuple
+
+from auth import load_credentials, authorized_http
+from retry_utils import http_retry
+
+if TYPE_CHECKING:
+    import google_auth_httplib2
+
+# Google API client modules are imported where they are used, so importing
+# this module stays cheap for callers that never talk to Sheets
 
 logger = logging.getLogger(__name__)
 
+# Client-side conversions for cell values the JSON body can't carry as-is;
+# str, int, float and bool pass through unchanged
+_COERCE = {
+    datetime: lambda v: v.isoformat(),
+    date: lambda v: v.isoformat(),
+    Decimal: float,
+    bytes: lambda v: v.decode('utf-8', 'replace'),
+    type(None): lambda v: '',
+}
+
+
+def _coerce_rows(rows: Iterable[List[Any]]) -> List[List[Any]]:
+    """
+    Convert row values into types the Sheets API accepts.
+    
+    Args:
+        rows: Rows of cell values
+        
+    Returns:
+        Rows with datetimes as ISO strings, Decimals as floats, bytes
+        decoded and None as an empty cell
+    """
+    coerce = _COERCE.get
+    coerced = []
+    for row in rows:
+        new_row = []
+        for value in row:
+            convert = coerce(type(value))
+            new_row.append(convert(value) if convert is not None else value)
+        coerced.append(new_row)
+    return coerced
+
 
 class GoogleSheetsService:
     """Service for interacting with Google Sheets API."""
@@ -29,35 +67,29 @@ class GoogleSheetsService:
         self.credentials_file = credentials_file
         self.token_file = token_file
         self.scopes = scopes
+        self.credentials = None
         self.service = None
+        self._range_locks = {}
+        self._range_locks_guard = threading.Lock()
+        self._read_cache: Dict[Tuple[str, str], Tuple[str, List[List[Any]]]] = {}
+        self._read_cache_lock = threading.Lock()
         self._authenticate()
     
     def _authenticate(self):
         """Authenticate with Google Sheets API."""
-        creds = None
-        
-        # Load saved credentials if they exist
-        if os.path.exists(self.token_file):
-            creds = Credentials.from_authorized_user_file(self.token_file, self.scopes)
-        
-        # If credentials are invalid or don't exist, get new ones
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self.credentials_file, self.scopes
-                )
-                creds = flow.run_local_server(port=0)
-            
-            # Save credentials for next run
-            with open(self.token_file, 'w') as token:
-                token.write(creds.to_json())
-        
-        self.service = build('sheets', 'v4', credentials=creds)
+        from googleapiclient.discovery import build
+        
+        creds = load_credentials(self.credentials_file, self.token_file, tuple(self.scopes))
+        
+        self.credentials = creds
+        self.service = build('sheets', 'v4', http=authorized_http(creds))
         logger.info("Successfully authenticated with Google Sheets API")
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    def _http(self) -> 'google_auth_httplib2.AuthorizedHttp':
+        """Get the authorized HTTP transport for the calling thread."""
+        return authorized_http(self.credentials)
+    
+    @http_retry
     def write_header(self, spreadsheet_id: str, range_name: str, headers: List[str]):
         """
         Write header row to spreadsheet.
@@ -67,17 +99,21 @@ class GoogleSheetsService:
             range_name: Range to write to (e.g., 'Sheet1!A1')
             headers: List of header values
         """
+        from googleapiclient.errors import HttpError
+        
         try:
             body = {
                 'values': [headers]
             }
             
+            self._invalidate_reads(spreadsheet_id)
+            
             result = self.service.spreadsheets().values().update(
                 spreadsheetId=spreadsheet_id,
                 range=range_name,
                 valueInputOption='RAW',
                 body=body
-            ).execute()
+            ).execute(http=self._http())
             
             logger.info(f"Header written: {result.get('updatedCells')} cells updated")
             return result
@@ -85,7 +121,7 @@ class GoogleSheetsService:
             logger.error(f"Error writing header: {error}")
             raise
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    @http_retry
     def append_rows(self, spreadsheet_id: str, range_name: str, rows: List[List[Any]]):
         """
         Append rows to spreadsheet.
@@ -95,18 +131,22 @@ class GoogleSheetsService:
             range_name: Range to append to (e.g., 'Sheet1!A1')
             rows: List of rows, where each row is a list of values
         """
+        from googleapiclient.errors import HttpError
+        
         try:
             body = {
-                'values': rows
+                'values': _coerce_rows(rows)
             }
             
+            self._invalidate_reads(spreadsheet_id)
+            
             result = self.service.spreadsheets().values().append(
                 spreadsheetId=spreadsheet_id,
                 range=range_name,
                 valueInputOption='RAW',
                 insertDataOption='INSERT_ROWS',
                 body=body
-            ).execute()
+            ).execute(http=self._http())
             
             logger.info(f"Appended {len(rows)} rows: {result.get('updates', {}).get('updatedCells')} cells updated")
             return result
@@ -114,7 +154,60 @@ class GoogleSheetsService:
             logger.error(f"Error appending rows: {error}")
             raise
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    def _invalidate_reads(self, spreadsheet_id: str):
+        """Drop cached reads for a spreadsheet this service is about to write to."""
+        with self._read_cache_lock:
+            for key in [key for key in self._read_cache if key[0] == spreadsheet_id]:
+                del self._read_cache[key]
+    
+    def _range_lock(self, spreadsheet_id: str, range_name: str) -> threading.Lock:
+        """Get the lock serializing appends to one spreadsheet range."""
+        with self._range_locks_guard:
+            return self._range_locks.setdefault((spreadsheet_id, range_name), threading.Lock())
+    
+    def append_rows_chunked(
+        self,
+        spreadsheet_id: str,
+        range_name: str,
+        rows: Iterable[List[Any]],
+        chunk_size: int = 2000
+    ) -> int:
+        """
+        Append rows to spreadsheet in fixed-size chunks.
+        
+        Each chunk is one append request, which keeps request bodies well below
+        the Sheets size limit. Only one chunk is held in memory at a time when
+        ``rows`` is an iterator. Chunks are sent one after another under a
+        per-range lock, because concurrent appends to the same range can land
+        out of order.
+        
+        Args:
+            spreadsheet_id: ID of the spreadsheet
+            range_name: Range to append to (e.g., 'Sheet1!A1')
+            rows: Iterable of rows, where each row is a list of values
+            chunk_size: Maximum number of rows per append request
+            
+        Returns:
+            Number of rows appended
+            
+        Raises:
+            ValueError: If chunk_size is less than 1
+        """
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size must be at least 1, got {chunk_size}")
+        
+        rows = iter(rows)
+        appended = 0
+        with self._range_lock(spreadsheet_id, range_name):
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                self.append_rows(spreadsheet_id, range_name, chunk)
+                appended += len(chunk)
+        return appended
+    
+    @http_retry
     def batch_update_rows(self, spreadsheet_id: str, range_name: str, rows: List[List[Any]]):
         """
         Batch update rows in spreadsheet.
@@ -124,17 +217,21 @@ class GoogleSheetsService:
             range_name: Range to update (e.g., 'Sheet1!A2:Z1000')
             rows: List of rows, where each row is a list of values
         """
+        from googleapiclient.errors import HttpError
+        
         try:
             body = {
-                'values': rows
+                'values': _coerce_rows(rows)
             }
             
+            self._invalidate_reads(spreadsheet_id)
+            
             result = self.service.spreadsheets().values().update(
                 spreadsheetId=spreadsheet_id,
                 range=range_name,
                 valueInputOption='RAW',
                 body=body
-            ).execute()
+            ).execute(http=self._http())
             
             logger.info(f"Updated {len(rows)} rows: {result.get('updatedCells')} cells updated")
             return result
@@ -142,7 +239,66 @@ class GoogleSheetsService:
             logger.error(f"Error batch updating rows: {error}")
             raise
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    @http_retry
+    def batch_update_values(self, spreadsheet_id: str, data: List[Dict[str, Any]]):
+        """
+        Write several ranges in a single request.
+        
+        Args:
+            spreadsheet_id: ID of the spreadsheet
+            data: List of {'range': ..., 'values': [...]} value ranges
+        """
+        from googleapiclient.errors import HttpError
+        
+        try:
+            body = {
+                'valueInputOption': 'RAW',
+                'data': [dict(item, values=_coerce_rows(item['values'])) for item in data]
+            }
+            
+            self._invalidate_reads(spreadsheet_id)
+            
+            result = self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body=body
+            ).execute(http=self._http())
+            
+            logger.info(f"Batch updated {len(data)} ranges: {result.get('totalUpdatedCells')} cells updated")
+            return result
+        except HttpError as error:
+            logger.error(f"Error batch updating values: {error}")
+            raise
+    
+    def write_header_and_rows(
+        self,
+        spreadsheet_id: str,
+        header_range: str,
+        headers: List[str],
+        data_range: str,
+        rows: List[List[Any]]
+    ):
+        """
+        Write the header row and the first rows in a single request.
+        
+        Replaces a ``write_header`` followed by ``append_rows``, saving a
+        round trip when populating a fresh sheet.
+        
+        Args:
+            spreadsheet_id: ID of the spreadsheet
+            header_range: Range to write the header to (e.g., 'Sheet1!A1')
+            headers: List of header values
+            data_range: Range to write the rows to (e.g., 'Sheet1!A2')
+            rows: List of rows, where each row is a list of values
+        """
+        return self.batch_update_values(
+            spreadsheet_id,
+            [
+                {'range': header_range, 'values': [headers]},
+                {'range': data_range, 'values': rows}
+            ]
+        )
+    
+    @http_retry
     def clear_range(self, spreadsheet_id: str, range_name: str):
         """
         Clear a range in the spreadsheet.
@@ -151,11 +307,15 @@ class GoogleSheetsService:
             spreadsheet_id: ID of the spreadsheet
             range_name: Range to clear (e.g., 'Sheet1!A1:Z1000')
         """
+        from googleapiclient.errors import HttpError
+        
         try:
+            self._invalidate_reads(spreadsheet_id)
+            
             result = self.service.spreadsheets().values().clear(
                 spreadsheetId=spreadsheet_id,
                 range=range_name
-            ).execute()
+            ).execute(http=self._http())
             
             logger.info(f"Cleared range: {range_name}")
             return result
@@ -163,26 +323,50 @@ class GoogleSheetsService:
             logger.error(f"Error clearing range: {error}")
             raise
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def get_values(self, spreadsheet_id: str, range_name: str) -> List[List[Any]]:
+    @http_retry
+    def get_values(
+        self,
+        spreadsheet_id: str,
+        range_name: str,
+        etag: Optional[str] = None
+    ) -> List[List[Any]]:
         """
         Get values from a range in the spreadsheet.
         
+        When ``etag`` is given (any token that changes whenever the
+        spreadsheet does, e.g. its Drive modifiedTime or version), a repeat
+        read with the same token is served from memory. Writes made through
+        this service drop the cached reads for that spreadsheet.
+        
         Args:
             spreadsheet_id: ID of the spreadsheet
             range_name: Range to get values from (e.g., 'Sheet1!A1:Z1000')
+            etag: Optional version token of the spreadsheet's current contents
             
         Returns:
             List of rows with values
         """
+        from googleapiclient.errors import HttpError
+        
+        cache_key = (spreadsheet_id, range_name)
+        if etag is not None:
+            with self._read_cache_lock:
+                cached = self._read_cache.get(cache_key)
+            if cached is not None and cached[0] == etag:
+                logger.debug(f"Using cached values for {range_name}")
+                return [list(row) for row in cached[1]]
+        
         try:
             result = self.service.spreadsheets().values().get(
                 spreadsheetId=spreadsheet_id,
                 range=range_name
-            ).execute()
+            ).execute(http=self._http())
             
             values = result.get('values', [])
             logger.info(f"Retrieved {len(values)} rows from {range_name}")
+            if etag is not None:
+                with self._read_cache_lock:
+                    self._read_cache[cache_key] = (etag, [list(row) for row in values])
             return values
         except HttpError as error:
             logger.error(f"Error getting values: {error}")
@@ -1,7 +1,13 @@
 """
 Unit tests for the Dealership Proof Analyzer application.
 """
+import importlib.util
+import os
+import subprocess
+import sys
+import time
 import unittest
+from unittest import mock
 from datetime import datetime
 from metadata_extractor import MetadataExtractor
 
@@ -9,9 +15,10 @@ from metadata_extractor import MetadataExtractor
 class TestMetadataExtractor(unittest.TestCase):
     """Test cases for MetadataExtractor class."""
     
-    def setUp(self):
-        """Set up test fixtures."""
-        self.extractor = MetadataExtractor()
+    @classmethod
+    def setUpClass(cls):
+        """Set up test fixtures shared by every test in the class."""
+        cls.extractor = MetadataExtractor()
     
     def test_extract_date_from_filename(self):
         """Test date extraction from various filename formats."""
@@ -91,6 +98,45 @@ class TestMetadataExtractor(unittest.TestCase):
             self.assertIsNotNone(metadata['model'],
                                f"Failed to extract model from {filename}")
     
+    def test_repeated_filename_returns_fresh_metadata(self):
+        """Test that cached extraction doesn't share state between calls."""
+        first = self.extractor.extract_from_filename('dealer_ABC_proof_v1.pdf')
+        first['dealership'] = 'changed'
+        
+        second = self.extractor.extract_from_filename('dealer_ABC_proof_v1.pdf')
+        self.assertEqual(second['dealership'], 'ABC')
+        self.assertEqual(second['version'], '1')
+    
+    def test_extract_from_path(self):
+        """Test extraction of folder-based metadata from a full path."""
+        metadata = self.extractor.extract_from_path(
+            'Proofs/client_Metro/2024/03_March/mailer_SPRING2024_v2.pdf'
+        )
+        
+        self.assertEqual(metadata['year_folder'], '2024')
+        self.assertEqual(metadata['month_folder'], '03')
+        self.assertEqual(metadata['dealership'], 'Metro')
+        self.assertEqual(metadata['version'], '2')
+        self.assertEqual(metadata['path_depth'], 5)
+    
+    def test_extract_from_filename_latency(self):
+        """Test that per-filename extraction stays fast across many distinct names."""
+        filenames = [
+            f"dealer_D{i}_2024-{i % 12 + 1:02d}-15_proof_v{i % 9}_state_CA_SPRING{i}.pdf"
+            for i in range(10000)
+        ]
+        
+        timings = []
+        for filename in filenames:
+            start = time.perf_counter()
+            self.extractor.extract_from_filename(filename)
+            timings.append(time.perf_counter() - start)
+        
+        timings.sort()
+        p99 = timings[int(len(timings) * 0.99)]
+        # Generous bound; typical p99 is well under a tenth of this
+        self.assertLess(p99, 0.005, f"p99 extraction latency {p99 * 1000:.2f} ms")
+    
     def test_parse_date_formats(self):
         """Test parsing of different date formats."""
         test_cases = [
@@ -128,44 +174,726 @@ class TestMetadataExtractor(unittest.TestCase):
         self.assertIsNotNone(metadata['region'])
 
 
-class TestConfigValidation(unittest.TestCase):
-    """Test cases for configuration validation."""
+class TestCouponInfoParsing(unittest.TestCase):
+    """Test cases for parsing Gemini coupon responses."""
+    
+    def test_parses_json_with_code_fence(self):
+        """Test that fenced JSON responses are decoded."""
+        from vertex_ai_service import parse_coupon_info
+        text = '```json\n{"offers": ["$500 off"], "expiration_date": null}\n```'
+        self.assertEqual(parse_coupon_info(text), {'offers': ['$500 off'], 'expiration_date': None})
+    
+    def test_returns_plain_text_unchanged(self):
+        """Test that non-JSON responses are passed through."""
+        from vertex_ai_service import parse_coupon_info
+        for text in ['No coupon offers found.', '{not valid json']:
+            self.assertEqual(parse_coupon_info(text), text)
+
+
+class TestFusedExtraction(unittest.TestCase):
+    """Test cases for combining several PDFs into one Gemini request."""
+    
+    def setUp(self):
+        """Build a service whose Gemini calls answer with the files they were asked about."""
+        import json
+        import re
+        import vertex_ai_service
+        from vertex_ai_service import VertexAIService
+        
+        self.service = VertexAIService('test-project', 'us-central1')
+        self.calls = []
+        self.fused_response = None
+        
+        def generate_text(contents, generation_config):
+            if isinstance(contents, str):
+                contents = [contents]
+            prompt = ''.join(part for part in contents if isinstance(part, str))
+            names = re.findall(r'File: (\S+)', prompt)
+            self.calls.append((names, generation_config))
+            if len(names) > 1:
+                if isinstance(self.fused_response, Exception):
+                    raise self.fused_response
+                if self.fused_response is not None:
+                    return self.fused_response
+                return json.dumps([{'offers': [name]} for name in names])
+            return json.dumps({'offers': names})
+        
+        self.service._generate_text = generate_text
+        # Stand in for the SDK's Part; only whether a PDF is attached matters
+        patcher = mock.patch.object(
+            vertex_ai_service, '_pdf_part',
+            side_effect=lambda pdf_content=None, gcs_uri=None: gcs_uri or pdf_content or None
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        self.file_data = [
+            {'filename': 'a.pdf', 'gcs_uri': 'gs://bucket/a.pdf'},
+            {'filename': 'b.pdf'},
+            {'filename': 'c.pdf', 'pdf_content': b'%PDF-c'},
+            {'filename': 'd.pdf', 'gcs_uri': 'gs://bucket/d.pdf'},
+            {'filename': 'e.pdf'},
+        ]
+    
+    def _extract(self, **kwargs):
+        return self.service.batch_extract_coupon_info(
+            self.file_data, max_workers=2, files_per_request=2, max_output_tokens=2048, **kwargs
+        )
+    
+    def test_results_keep_file_order(self):
+        """Test that PDFs are grouped, text-only files go alone, and results map back in order."""
+        results = self._extract()
+        
+        self.assertEqual(results, [{'offers': [data['filename']]} for data in self.file_data])
+        requests = sorted(names for names, _ in self.calls)
+        self.assertEqual(requests, [['a.pdf', 'c.pdf'], ['b.pdf'], ['d.pdf'], ['e.pdf']])
+    
+    def test_fused_output_tokens_capped(self):
+        """Test that a group's token budget scales with its size up to the model's limit."""
+        self._extract(max_request_output_tokens=3000)
+        fused_config = next(config for names, config in self.calls if len(names) > 1)
+        self.assertEqual(fused_config['max_output_tokens'], 3000)
+    
+    def test_falls_back_per_file(self):
+        """Test that a failed or mismatched combined response is retried file by file."""
+        for fused_response in (RuntimeError('quota'), '[{"offers": []}]', 'not json'):
+            with self.subTest(fused_response=fused_response):
+                self.calls.clear()
+                self.fused_response = fused_response
+                
+                results = self._extract()
+                
+                self.assertEqual(results, [{'offers': [data['filename']]} for data in self.file_data])
+                single_requests = sorted(names for names, _ in self.calls if len(names) == 1)
+                self.assertEqual(single_requests, [['a.pdf'], ['b.pdf'], ['c.pdf'], ['d.pdf'], ['e.pdf']])
+
+
+class TestSheetsRowCoercion(unittest.TestCase):
+    """Test cases for converting row values before writing to Sheets."""
+    
+    def test_coerce_rows(self):
+        """Test that non-JSON cell values are converted and others pass through."""
+        from decimal import Decimal
+        from sheets_service import _coerce_rows
+        rows = [[datetime(2024, 1, 15, 10, 30), Decimal('499.99'), b'ABC', None, 'text', 3, True]]
+        self.assertEqual(
+            _coerce_rows(rows),
+            [['2024-01-15T10:30:00', 499.99, 'ABC', '', 'text', 3, True]]
+        )
+
+
+class TestCouponInfoCache(unittest.TestCase):
+    """Test cases for the SQLite coupon info cache."""
+    
+    def setUp(self):
+        """Open a cache in a fresh temporary directory."""
+        import tempfile
+        from local_cache import CouponInfoCache
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'coupons.db')
+        self.cache = CouponInfoCache(self.path, max_entries=2)
+        self.addCleanup(self.cache.close)
+    
+    def test_make_key_is_stable(self):
+        """Test that keys ignore dict order but change with any input."""
+        make_key = self.cache.make_key
+        metadata = {'dealer': 'Acme', 'year': 2024}
+        key = make_key('a.pdf', metadata, b'%PDF', model='m', temperature=0.1)
+        
+        self.assertEqual(
+            key, make_key('a.pdf', {'year': 2024, 'dealer': 'Acme'}, b'%PDF', temperature=0.1, model='m')
+        )
+        for changed in [
+            make_key('b.pdf', metadata, b'%PDF', model='m', temperature=0.1),
+            make_key('a.pdf', {'dealer': 'Beta', 'year': 2024}, b'%PDF', model='m', temperature=0.1),
+            make_key('a.pdf', metadata, b'%PDF-2', model='m', temperature=0.1),
+            make_key('a.pdf', metadata, b'%PDF', model='m', temperature=0.2),
+        ]:
+            self.assertNotEqual(key, changed)
+    
+    def test_round_trip(self):
+        """Test that dict and plain-text results come back as stored, across reopen."""
+        from local_cache import CouponInfoCache
+        self.assertIsNone(self.cache.get('missing'))
+        
+        self.cache.set('parsed', {'offers': [{'amount': 500}]})
+        self.cache.set('text', 'No offers found')
+        self.assertEqual(self.cache.get('parsed'), {'offers': [{'amount': 500}]})
+        self.assertEqual(self.cache.get('text'), 'No offers found')
+        
+        self.cache.close()
+        self.cache = CouponInfoCache(self.path, max_entries=2)
+        self.assertEqual(self.cache.get('text'), 'No offers found')
+    
+    def test_evicts_least_recently_used(self):
+        """Test that the entry unused for longest goes first once over max_entries."""
+        import itertools
+        import local_cache
+        
+        with mock.patch.object(local_cache.time, 'time', side_effect=itertools.count(1.0)):
+            self.cache.set('a', 1)
+            self.cache.set('b', 2)
+            self.cache.get('a')
+            self.cache.set('b', 3)  # replacing an entry doesn't evict
+            self.assertEqual(self.cache.get('a'), 1)
+            self.cache.set('c', 4)
+        
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('c'), 4)
+    
+    def test_unopenable_path_raises_sqlite_error(self):
+        """Test that a bad cache path raises sqlite3.Error for callers to handle."""
+        import sqlite3
+        from local_cache import CouponInfoCache
+        with self.assertRaises(sqlite3.Error):
+            CouponInfoCache(os.path.join(self.path, 'missing', 'coupons.db'))
+
+
+class TestPdfContentCache(unittest.TestCase):
+    """Test cases for the on-disk PDF content cache."""
+    
+    def setUp(self):
+        """Open a cache in a fresh temporary directory."""
+        import tempfile
+        from local_cache import PdfContentCache
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = os.path.join(tmp.name, 'pdfs')
+        self.cache = PdfContentCache(self.directory)
+    
+    def test_hit_and_miss(self):
+        """Test that content is returned only for the version it was stored under."""
+        self.assertIsNone(self.cache.get('file-1', '2024-01-15T10:30:00.000Z'))
+        
+        self.cache.set('file-1', '2024-01-15T10:30:00.000Z', b'%PDF-1')
+        
+        self.assertEqual(self.cache.get('file-1', '2024-01-15T10:30:00.000Z'), b'%PDF-1')
+        self.assertIsNone(self.cache.get('file-1', '2024-02-01T00:00:00.000Z'))
+        self.assertIsNone(self.cache.get('file-2', '2024-01-15T10:30:00.000Z'))
+    
+    def test_file_names_avoid_colons(self):
+        """Test that timestamps are stored under file names valid on every platform."""
+        self.cache.set('file-1', '2024-01-15T10:30:00.000Z', b'%PDF-1')
+        self.assertEqual(
+            os.listdir(os.path.join(self.directory, 'file-1')), ['2024-01-15T10-30-00.000Z.pdf']
+        )
+    
+    def test_new_version_replaces_old(self):
+        """Test that storing a newer version removes older ones and leaves no temp files."""
+        self.cache.set('file-1', '2024-01-15T10:30:00.000Z', b'%PDF-1')
+        self.cache.set('file-1', '2024-02-01T00:00:00.000Z', b'%PDF-2')
+        # Storing the same version again (a file listed twice) keeps it
+        self.cache.set('file-1', '2024-02-01T00:00:00.000Z', b'%PDF-2')
+        
+        self.assertEqual(
+            os.listdir(os.path.join(self.directory, 'file-1')), ['2024-02-01T00-00-00.000Z.pdf']
+        )
+        self.assertIsNone(self.cache.get('file-1', '2024-01-15T10:30:00.000Z'))
+        self.assertEqual(self.cache.get('file-1', '2024-02-01T00:00:00.000Z'), b'%PDF-2')
+
+
+def make_sheets_service():
+    """Build a GoogleSheetsService without authenticating, over a mock API client."""
+    from sheets_service import GoogleSheetsService
+    with mock.patch.object(GoogleSheetsService, '_authenticate'):
+        service = GoogleSheetsService('credentials.json', 'token.json', [])
+    service.service = mock.MagicMock()
+    service._http = lambda: None
+    return service
+
+
+class TestSheetsService(unittest.TestCase):
+    """Test cases for GoogleSheetsService request handling."""
+    
+    def test_append_rows_chunked(self):
+        """Test that an iterator of rows is appended in order, chunk_size rows at a time."""
+        service = make_sheets_service()
+        service.append_rows = mock.MagicMock()
+        rows = ([str(i)] for i in range(7))
+        
+        self.assertEqual(service.append_rows_chunked('sheet-id', 'Sheet1!A1', rows, chunk_size=3), 7)
+        
+        chunks = [call.args[2] for call in service.append_rows.call_args_list]
+        self.assertEqual(chunks, [[['0'], ['1'], ['2']], [['3'], ['4'], ['5']], [['6']]])
+    
+    def test_append_rows_chunked_rejects_empty_chunks(self):
+        """Test that a chunk size below 1 is rejected instead of dropping every row."""
+        service = make_sheets_service()
+        service.append_rows = mock.MagicMock()
+        for chunk_size in (0, -1):
+            with self.assertRaises(ValueError):
+                service.append_rows_chunked('sheet-id', 'Sheet1!A1', [['row']], chunk_size=chunk_size)
+        service.append_rows.assert_not_called()
+
+    
+    def test_get_values_cached_by_etag(self):
+        """Test that a repeated read with the same etag skips the request, and a new etag refetches."""
+        service = make_sheets_service()
+        values_api = service.service.spreadsheets.return_value.values.return_value
+        values_api.get.return_value.execute.return_value = {'values': [['a', 'b']]}
+        
+        self.assertEqual(service.get_values('sheet-id', 'Sheet1!A:B', etag='v1'), [['a', 'b']])
+        self.assertEqual(service.get_values('sheet-id', 'Sheet1!A:B', etag='v1'), [['a', 'b']])
+        self.assertEqual(values_api.get.call_count, 1)
+        
+        values_api.get.return_value.execute.return_value = {'values': [['c']]}
+        self.assertEqual(service.get_values('sheet-id', 'Sheet1!A:B', etag='v2'), [['c']])
+        self.assertEqual(values_api.get.call_count, 2)
+        
+        service.get_values('sheet-id', 'Sheet1!A:B')
+        self.assertEqual(values_api.get.call_count, 3)
+    
+    def test_writes_invalidate_cached_values(self):
+        """Test that writing to a spreadsheet drops its cached reads."""
+        service = make_sheets_service()
+        values_api = service.service.spreadsheets.return_value.values.return_value
+        values_api.get.return_value.execute.return_value = {'values': [['a']]}
+        writes = [
+            lambda: service.append_rows('sheet-id', 'Sheet1!A1', [['x']]),
+            lambda: service.batch_update_values('sheet-id', [{'range': 'Sheet1!A1', 'values': [['x']]}]),
+            lambda: service.clear_range('sheet-id', 'Sheet1!A:B'),
+        ]
+        
+        for number, write in enumerate(writes, start=1):
+            service.get_values('sheet-id', 'Sheet1!A:B', etag='v1')
+            self.assertEqual(values_api.get.call_count, number)
+            write()
+        service.get_values('sheet-id', 'Sheet1!A:B', etag='v1')
+        self.assertEqual(values_api.get.call_count, len(writes) + 1)
+    
+    def test_cached_values_isolated_from_callers(self):
+        """Test that mutating returned rows doesn't change what the cache returns."""
+        service = make_sheets_service()
+        values_api = service.service.spreadsheets.return_value.values.return_value
+        values_api.get.return_value.execute.return_value = {'values': [['a', 'b']]}
+        
+        service.get_values('sheet-id', 'Sheet1!A:B', etag='v1')[0].append('fresh')
+        cached = service.get_values('sheet-id', 'Sheet1!A:B', etag='v1')
+        cached[0].append('cached')
+        cached.append(['extra'])
+        
+        self.assertEqual(service.get_values('sheet-id', 'Sheet1!A:B', etag='v1'), [['a', 'b']])
+        self.assertEqual(values_api.get.call_count, 1)
+
+
+class FakeSheetsService:
+    """In-memory stand-in for GoogleSheetsService recording each write request."""
+    
+    def __init__(self, existing_rows=0, fail=False):
+        self.existing_rows = existing_rows
+        self.fail = fail
+        self.requests = []
+    
+    def get_values(self, spreadsheet_id, range_name, etag=None):
+        return [['value']] * self.existing_rows
+    
+    def batch_update_values(self, spreadsheet_id, data):
+        if self.fail:
+            raise RuntimeError('Sheets unavailable')
+        self.requests.append(data)
+    
+    def write_header_and_rows(self, spreadsheet_id, header_range, headers, data_range, rows):
+        self.batch_update_values(spreadsheet_id, [
+            {'range': header_range, 'values': [headers]},
+            {'range': data_range, 'values': rows}
+        ])
+
+
+class TestSheetsWriter(unittest.TestCase):
+    """Test cases for streaming result rows to Google Sheets."""
+    
+    @classmethod
+    def setUpClass(cls):
+        """Import the application module once for the class."""
+        import main
+        cls.main = main
+    
+    def _write(self, sheets, results, sheets_range='Sheet1!A1', batch_size=3):
+        analyzer = self.main.DealershipProofAnalyzer.__new__(self.main.DealershipProofAnalyzer)
+        analyzer.sheets_service = sheets
+        with mock.patch.object(self.main.Config, 'SHEETS_RANGE', sheets_range), \
+                mock.patch.object(self.main.Config, 'BATCH_SIZE', batch_size):
+            return analyzer.write_results_to_sheets(results)
+    
+    def test_split_a1(self):
+        """Test splitting A1 ranges into sheet prefix, column and row."""
+        test_cases = [
+            ('Sheet1!A1', ('Sheet1!', 'A', 1)),
+            ('Sheet1!B5:M', ('Sheet1!', 'B', 5)),
+            ('Sheet1!A:M', ('Sheet1!', 'A', 1)),
+            ('Sheet1', ('Sheet1!', 'A', 1)),
+            ("'My Sheet'!AB10", ("'My Sheet'!", 'AB', 10)),
+            ('C3', ('', 'C', 3)),
+        ]
+        
+        for range_name, expected in test_cases:
+            with self.subTest(range_name=range_name):
+                self.assertEqual(self.main._split_a1(range_name), expected)
+    
+    def test_rows_written_in_contiguous_batches(self):
+        """Test that the header is fused into the first write and ranges follow on."""
+        results = [{'file_id': f'id{i}', 'coupon_info': {'offers': []}} for i in range(10)]
+        sheets = FakeSheetsService(existing_rows=3)
+        
+        self.assertEqual(self._write(sheets, results, sheets_range='Sheet1!B2:M'), 10)
+        
+        header = sheets.requests[0][0]
+        self.assertEqual(header, {'range': 'Sheet1!B2:M', 'values': [self.main.SHEET_HEADERS]})
+        data_requests = [sheets.requests[0][1:]] + sheets.requests[1:]
+        
+        # Existing rows start at the header row, so new rows go below them
+        next_row = 5
+        written = []
+        for number, request in enumerate(data_requests, start=1):
+            rows_in_request = 0
+            for entry in request:
+                self.assertEqual(entry['range'], f'Sheet1!B{next_row}')
+                next_row += len(entry['values'])
+                rows_in_request += len(entry['values'])
+                written.extend(entry['values'])
+            if number < len(data_requests):
+                # Only the final flush may be smaller than BATCH_SIZE
+                self.assertGreaterEqual(rows_in_request, 3)
+        self.assertEqual([row[0] for row in written], [f'id{i}' for i in range(10)])
+    
+    def test_writes_stay_under_cell_limit(self):
+        """Test that a large BATCH_SIZE is split into requests under MAX_CELLS_PER_WRITE."""
+        results = [{'file_id': f'id{i}'} for i in range(2000)]
+        sheets = FakeSheetsService()
+        
+        self.assertEqual(self._write(sheets, results, batch_size=2000), 2000)
+        
+        row_count = 0
+        for request in sheets.requests:
+            cells = sum(len(row) for entry in request for row in entry['values'])
+            self.assertLessEqual(cells, self.main.MAX_CELLS_PER_WRITE)
+            row_count += sum(len(entry['values']) for entry in request)
+        self.assertEqual(row_count, 2000 + 1)
+    
+    def test_writer_error_reaches_caller(self):
+        """Test that a failed Sheets write is raised from write_results_to_sheets."""
+        produced = []
+        
+        def results():
+            for i in range(50):
+                produced.append(i)
+                time.sleep(0.01)
+                yield {'file_id': f'id{i}'}
+        
+        generator = results()
+        with self.assertRaises(RuntimeError):
+            self._write(FakeSheetsService(fail=True), generator, batch_size=2)
+        
+        # The producer is closed once the writer fails, not drained
+        self.assertLess(len(produced), 50)
+        self.assertIsNone(generator.gi_frame)
+
+
+class FakeDriveListing:
+    """In-memory folder tree answering list_files_in_folders a page at a time."""
+    
+    FOLDER = 'application/vnd.google-apps.folder'
+    PDF = 'application/pdf'
+    
+    def __init__(self, tree, page_size=2):
+        # tree maps folder ID to a list of (id, name, mime type) children
+        self.tree = tree
+        self.page_size = page_size
+        self.queries = []
+    
+    def list_files_in_folders(self, folder_ids, pdf_only=False, page_token=None, fields=None):
+        self.queries.append(list(folder_ids))
+        children = [
+            {'id': child_id, 'name': name, 'mimeType': mime_type, 'parents': [folder_id]}
+            for folder_id in folder_ids
+            for child_id, name, mime_type in self.tree.get(folder_id, [])
+        ]
+        start = int(page_token or 0)
+        results = {'files': children[start:start + self.page_size]}
+        if start + self.page_size < len(children):
+            results['nextPageToken'] = str(start + self.page_size)
+        return results
+
+
+class TestDriveCrawl(unittest.TestCase):
+    """Test cases for crawling the Drive folder tree."""
+    
+    def setUp(self):
+        """Build a Drive service backed by an in-memory folder tree."""
+        from drive_service import GoogleDriveService
+        
+        folder, pdf = FakeDriveListing.FOLDER, FakeDriveListing.PDF
+        self.listing = FakeDriveListing({
+            'root': [('dealers', 'Dealerships', folder), ('other', 'Other', folder), ('f0', 'root.pdf', pdf)],
+            'dealers': [('acme', 'Acme', folder), ('beta', 'Beta', folder), ('notes', 'notes.txt', 'text/plain')],
+            'acme': [('acme-proofs', 'Proofs', folder), ('drafts', 'Drafts', folder)],
+            'beta': [('beta-proofs', 'Proofs', folder)],
+            'acme-proofs': [('f1', 'acme.pdf', pdf), ('old', 'Old', folder)],
+            'old': [('f2', 'acme_v1.pdf', pdf)],
+            'beta-proofs': [('f3', 'beta.pdf', pdf)],
+            'drafts': [('f4', 'draft.pdf', pdf)],
+            'other': [('f5', 'other.pdf', pdf)],
+        })
+        # Skip authentication; only the listing call is exercised
+        self.drive = GoogleDriveService.__new__(GoogleDriveService)
+        self.drive.list_files_in_folders = self.listing.list_files_in_folders
+    
+    def _crawled_ids(self, **kwargs):
+        return sorted(f['id'] for f in self.drive.crawl_folder_structure('root', **kwargs))
+    
+    def test_crawl_finds_every_pdf(self):
+        """Test that paginated, multi-parent listings reach the whole tree."""
+        self.assertEqual(
+            self._crawled_ids(max_workers=1, parents_per_query=3),
+            ['f0', 'f1', 'f2', 'f3', 'f4', 'f5']
+        )
+        self.assertTrue(any(len(folder_ids) > 1 for folder_ids in self.listing.queries))
+        self.assertTrue(all(len(folder_ids) <= 3 for folder_ids in self.listing.queries))
+    
+    def test_path_glob_prunes_folders(self):
+        """Test that only subtrees matching the path glob are listed and returned."""
+        self.assertEqual(
+            self._crawled_ids(path_glob='Dealerships/*/Proofs', parents_per_query=2),
+            ['f1', 'f2', 'f3']
+        )
+        listed = {folder_id for folder_ids in self.listing.queries for folder_id in folder_ids}
+        self.assertNotIn('other', listed)
+        self.assertNotIn('drafts', listed)
+    
+    def test_rejects_empty_queries_and_pools(self):
+        """Test that limits below 1 are rejected instead of hanging the crawl."""
+        with self.assertRaises(ValueError):
+            self.drive.crawl_folder_structure('root', parents_per_query=0)
+        with self.assertRaises(ValueError):
+            self.drive.crawl_folder_structure('root', max_workers=0)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """Test cases for the Drive/Sheets retry policy."""
+    
+    @staticmethod
+    def _http_error(status, headers=None, content=b''):
+        import httplib2
+        from googleapiclient.errors import HttpError
+        return HttpError(httplib2.Response(dict(headers or {}, status=status)), content)
+    
+    def _retried(self, errors):
+        """Wrap a call failing with each of errors in turn, recording calls and sleeps."""
+        import retry_utils
+        
+        calls = []
+        sleeps = []
+        
+        def policy():
+            # The real stop and wait, with sleeps recorded instead of taken
+            return dict(retry_utils._http_retry_policy(), sleep=sleeps.append)
+        
+        @retry_utils.lazy_retry(policy, retry_utils.is_retryable_http_error)
+        def call():
+            calls.append(1)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return 'ok'
+        
+        return call, calls, sleeps
+    
+    def test_persistent_failure_stops_after_five_attempts(self):
+        """Test that a call failing every time is attempted five times, then re-raised."""
+        from googleapiclient.errors import HttpError
+        call, calls, sleeps = self._retried([self._http_error(503)] * 10)
+        with mock.patch('random.uniform', return_value=0):
+            with self.assertRaises(HttpError):
+                call()
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(sleeps, [1, 2, 4, 8])
+    
+    def test_client_error_not_retried(self):
+        """Test that a 404 surfaces straight away."""
+        from googleapiclient.errors import HttpError
+        call, calls, sleeps = self._retried([self._http_error(404)])
+        with self.assertRaises(HttpError):
+            call()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sleeps, [])
+    
+    def test_retry_after_sets_wait(self):
+        """Test that the server's Retry-After is waited out before retrying."""
+        call, calls, sleeps = self._retried([self._http_error(429, {'retry-after': '3'})])
+        self.assertEqual(call(), 'ok')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sleeps, [3.0])
+    
+    def test_rate_limit_403_retried(self):
+        """Test that 403s are retried only when their body reports a rate limit."""
+        import json
+        from retry_utils import is_retryable_http_error
+        
+        def forbidden(errors=None, details=None):
+            body = {'error': {'code': 403, 'message': 'Forbidden'}}
+            if errors is not None:
+                body['error']['errors'] = errors
+            if details is not None:
+                body['error']['details'] = details
+            return self._http_error(403, content=json.dumps(body).encode())
+        
+        error_info = {'@type': 'type.googleapis.com/google.rpc.ErrorInfo', 'domain': 'googleapis.com'}
+        legacy = [{'reason': 'userRateLimitExceeded', 'domain': 'usageLimits'}]
+        
+        self.assertTrue(is_retryable_http_error(forbidden(errors=legacy)))
+        # With both formats present, googleapiclient only exposes the details
+        self.assertTrue(is_retryable_http_error(forbidden(
+            errors=[{'reason': 'rateLimitExceeded'}],
+            details=[dict(error_info, reason='SOME_OTHER_REASON')]
+        )))
+        self.assertTrue(is_retryable_http_error(
+            forbidden(details=[dict(error_info, reason='RATE_LIMIT_EXCEEDED')])
+        ))
+        self.assertFalse(is_retryable_http_error(forbidden(errors=[{'reason': 'insufficientPermissions'}])))
+        self.assertFalse(is_retryable_http_error(forbidden()))
+    
+    def test_server_retry_delay(self):
+        """Test reading, clamping and rejecting server-requested delays."""
+        from retry_utils import MAX_RETRY_AFTER, server_retry_delay
+        retry_info = b'{"error": {"details": [{"retryDelay": "%s"}]}}'
+        
+        self.assertEqual(server_retry_delay(self._http_error(429, {'retry-after': '2.5'})), 2.5)
+        self.assertEqual(server_retry_delay(self._http_error(429, content=retry_info % b'4s')), 4.0)
+        self.assertEqual(
+            server_retry_delay(self._http_error(429, {'retry-after': '100000'})), MAX_RETRY_AFTER
+        )
+        for value in ('nan', 'inf', '-inf'):
+            self.assertIsNone(server_retry_delay(self._http_error(429, {'retry-after': value})))
+            self.assertIsNone(
+                server_retry_delay(self._http_error(429, content=retry_info % f'{value}s'.encode()))
+            )
+
+
+class FakeDriveBatch:
+    """Stand-in for a Drive batch request answering each part from a script."""
+    
+    def __init__(self, answer, callback, batch_number):
+        # answer(file_id, batch_number) returns the part's (response, exception)
+        self.answer = answer
+        self.callback = callback
+        self.batch_number = batch_number
+        self.request_ids = []
+    
+    def add(self, request, request_id):
+        self.request_ids.append(request_id)
+    
+    def execute(self, http=None):
+        for request_id in self.request_ids:
+            self.callback(request_id, *self.answer(request_id, self.batch_number))
+
+
+class TestDriveMetadataBatch(unittest.TestCase):
+    """Test cases for fetching file metadata through the Drive batch endpoint."""
+    
+    def setUp(self):
+        """Build a Drive service whose batches answer from self.answer."""
+        from drive_service import GoogleDriveService
+        
+        self.batches = []
+        self.drive = GoogleDriveService.__new__(GoogleDriveService)
+        self.drive.service = mock.MagicMock()
+        self.drive.service.new_batch_http_request.side_effect = self._new_batch
+        self.drive._http = lambda: None
+    
+    def _new_batch(self, callback):
+        batch = FakeDriveBatch(self.answer, callback, len(self.batches))
+        self.batches.append(batch.request_ids)
+        return batch
     
-    def test_config_imports(self):
-        """Test that config module imports successfully."""
-        try:
-            from config import Config
-            self.assertIsNotNone(Config)
-        except ImportError as e:
-            self.fail(f"Failed to import Config: {e}")
+    @staticmethod
+    def _http_error(status, reason=None):
+        import json
+        import httplib2
+        from googleapiclient.errors import HttpError
+        body = {'error': {'code': status, 'message': 'failed'}}
+        if reason:
+            body['error']['errors'] = [{'reason': reason}]
+        # Retry-After: 0 keeps retries from sleeping
+        return HttpError(httplib2.Response({'status': status, 'retry-after': '0'}), json.dumps(body).encode())
+    
+    def test_retryable_parts_resubmitted(self):
+        """Test that rate-limited parts are retried alone and permanent failures dropped."""
+        failures = {
+            'b': self._http_error(429),
+            'c': self._http_error(404),
+            'd': self._http_error(403, 'userRateLimitExceeded'),
+        }
+        
+        def answer(file_id, batch_number):
+            if batch_number == 0 and file_id in failures:
+                return None, failures[file_id]
+            if file_id == 'c':
+                return None, failures['c']
+            return {'id': file_id}, None
+        
+        self.answer = answer
+        metadata = self.drive.get_files_metadata(['a', 'b', 'c', 'd', 'e'], batch_size=4)
+        
+        self.assertEqual(sorted(metadata), ['a', 'b', 'd', 'e'])
+        self.assertEqual(self.batches, [['a', 'b', 'c', 'd'], ['b', 'd'], ['e']])
+    
+    def test_persistent_rate_limit_gives_up(self):
+        """Test that a part failing on every attempt is omitted after the retry limit."""
+        self.answer = lambda file_id, batch_number: (
+            (None, self._http_error(429)) if file_id == 'b' else ({'id': file_id}, None)
+        )
+        metadata = self.drive.get_files_metadata(['a', 'b'])
+        
+        self.assertEqual(sorted(metadata), ['a'])
+        self.assertEqual(self.batches, [['a', 'b']] + [['b']] * 4)
 
 
 class TestServiceImports(unittest.TestCase):
-    """Test cases for service module imports."""
-    
-    def test_drive_service_import(self):
-        """Test that drive_service module imports successfully."""
-        try:
-            from drive_service import GoogleDriveService
-            self.assertIsNotNone(GoogleDriveService)
-        except ImportError as e:
-            self.fail(f"Failed to import GoogleDriveService: {e}")
-    
-    def test_sheets_service_import(self):
-        """Test that sheets_service module imports successfully."""
-        try:
-            from sheets_service import GoogleSheetsService
-            self.assertIsNotNone(GoogleSheetsService)
-        except ImportError as e:
-            self.fail(f"Failed to import GoogleSheetsService: {e}")
-    
-    def test_vertex_ai_service_import(self):
-        """Test that vertex_ai_service module imports successfully."""
-        try:
-            from vertex_ai_service import VertexAIService
-            self.assertIsNotNone(VertexAIService)
-        except ImportError as e:
-            self.fail(f"Failed to import VertexAIService: {e}")
+    """Test cases for config and service module imports."""
+    
+    def test_modules_available(self):
+        """Test that config and service modules can be found without importing them."""
+        for module_name in ('config', 'drive_service', 'sheets_service', 'vertex_ai_service'):
+            with self.subTest(module=module_name):
+                self.assertIsNotNone(importlib.util.find_spec(module_name))
+    
+    @unittest.skipUnless(os.getenv('RUN_INTEGRATION'), 'set RUN_INTEGRATION=1 to run')
+    def test_services_construct(self):
+        """Test that the services import and build their clients with stub credentials."""
+        from google.oauth2.credentials import Credentials
+        import drive_service
+        import sheets_service
+        from vertex_ai_service import VertexAIService
+        
+        credentials = Credentials(token='test-token')
+        for module, service_class in [
+            (drive_service, drive_service.GoogleDriveService),
+            (sheets_service, sheets_service.GoogleSheetsService),
+        ]:
+            with self.subTest(service=service_class.__name__):
+                with mock.patch.object(module, 'load_credentials', return_value=credentials):
+                    service = service_class('credentials.json', 'token.json', ['scope'])
+                self.assertIsNotNone(service.service)
+        
+        self.assertIsNotNone(VertexAIService('test-project', 'us-central1'))
+    
+    def test_service_imports_defer_google_sdks(self):
+        """Test that importing a service module doesn't load the Google SDKs."""
+        checks = [
+            ('sheets_service', 'googleapiclient'),
+            ('vertex_ai_service', 'vertexai'),
+            ('vertex_ai_service', 'google.cloud.aiplatform'),
+        ]
+        
+        for module, heavy_module in checks:
+            # A fresh interpreter, since this process may have loaded them already
+            code = f"import sys, {module}; print({heavy_module!r} in sys.modules)"
+            output = subprocess.run(
+                [sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).stdout.strip()
+            self.assertEqual(output, 'False', f"Importing {module} loaded {heavy_module}")
 
 
 if __name__ == '__main__':
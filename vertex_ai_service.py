@@ -1,16 +1,162 @@
 """
 Vertex AI service for extracting coupon information from PDF content using Gemini.
 """
+import functools
+import json
 import logging
-from typing import Dict, Optional
-from google.cloud import aiplatform
-from vertexai.generative_models import GenerativeModel, Part
-import vertexai
-from tenacity import retry, stop_after_attempt, wait_exponential
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from retry_utils import lazy_retry
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json is used without it
+    orjson = None
+
+# The Vertex AI SDK is imported when the model is first needed, so importing
+# this module (e.g. for parse_coupon_info) doesn't load protobuf, grpc and friends
 
 logger = logging.getLogger(__name__)
 
 
+def _is_retryable(error: BaseException) -> bool:
+    """Check whether a Gemini failure is a quota or availability error."""
+    from google.api_core.exceptions import DeadlineExceeded, ResourceExhausted, ServiceUnavailable
+    return isinstance(error, (ResourceExhausted, ServiceUnavailable, DeadlineExceeded))
+
+
+def _retry_policy() -> Dict[str, Any]:
+    """Retry policy for Gemini calls."""
+    from tenacity import stop_after_attempt, wait_exponential_jitter
+    # Jitter keeps concurrent workers that hit the quota together from
+    # retrying in lockstep
+    return {
+        'stop': stop_after_attempt(5),
+        'wait': wait_exponential_jitter(initial=1, max=16),
+        'reraise': True
+    }
+
+
+# What to extract and the keys to answer with, shared by the single-file
+# and fused prompts; {source} and {shape} say how many documents are asked about
+_EXTRACTION_INSTRUCTIONS = """Please extract the following information about coupon offers from {source}:
+1. Coupon offer description (e.g., "$500 off", "0% APR for 60 months", "Free oil changes for 1 year")
+2. Expiration date (if mentioned)
+3. Terms and conditions (brief summary)
+4. Target vehicle models or types (if specified)
+5. Any special requirements or restrictions
+
+Format your response as {shape} with the following keys:
+- offers: List of offer descriptions
+- expiration_date: The expiration date if found, otherwise null
+- terms: Brief summary of terms and conditions
+- target_vehicles: List of vehicle models or types
+- restrictions: Any special requirements
+"""
+
+# Extraction prompt, filled in per file with format_map
+_PROMPT_TEMPLATE = (
+    "You are analyzing a Direct Mail PDF proof for a dealership.\n\n"
+    "File: {filename}\n"
+    "Metadata: {metadata}\n\n"
+    + _EXTRACTION_INSTRUCTIONS.format(source='this document', shape='a structured JSON object')
+    + "\nIf no coupon information is found, return an empty offers list.\n"
+)
+
+# Extraction prompt for several PDFs answered in one request, filled in with format
+_FUSED_PROMPT_HEADER = (
+    "You are analyzing {count} Direct Mail PDF proofs for a dealership. "
+    "Each PDF follows the line naming it, numbered in order.\n\n"
+)
+_FUSED_PROMPT_BODY = (
+    "\n"
+    + _EXTRACTION_INSTRUCTIONS.format(
+        source='each document separately',
+        shape='a JSON array with exactly {count} objects, one per document in the order given, each'
+    )
+    + "\nIf a document has no coupon information, return an empty offers list for it.\n"
+)
+
+# Default output token ceiling for a fused request; batch_extract_coupon_info
+# takes the configured model's own limit when it differs
+DEFAULT_MAX_REQUEST_OUTPUT_TOKENS = 8192
+
+
+@functools.lru_cache(maxsize=2048)
+def _prompt_for(filename: str, metadata_items: tuple) -> str:
+    """Build the extraction prompt for one file from its metadata items."""
+    return _PROMPT_TEMPLATE.format_map({'filename': filename, 'metadata': dict(metadata_items)})
+
+
+def _pdf_part(pdf_content: Optional[bytes] = None, gcs_uri: Optional[str] = None):
+    """
+    Build the Part carrying a PDF, preferring a Cloud Storage reference.
+    
+    With ``gcs_uri`` Gemini fetches the file server-side, so the bytes never
+    pass through this client.
+    
+    Args:
+        pdf_content: Optional PDF content as bytes
+        gcs_uri: Optional gs:// URI of the same PDF
+        
+    Returns:
+        Part for the PDF, or None if neither source is given
+    """
+    if not gcs_uri and not pdf_content:
+        return None
+    
+    from vertexai.generative_models import Part
+    if gcs_uri:
+        return Part.from_uri(uri=gcs_uri, mime_type="application/pdf")
+    return Part.from_data(data=pdf_content, mime_type="application/pdf")
+
+
+def parse_coupon_info(text: str) -> Any:
+    """
+    Decode a model response that holds JSON, tolerating Markdown code fences.
+    
+    Args:
+        text: Raw model response
+        
+    Returns:
+        Parsed JSON object or list, or the original text if it isn't JSON
+    """
+    body = text.strip()
+    if body.startswith('```'):
+        body = body.strip('`').strip()
+        if body[:4].lower() == 'json':
+            body = body[4:].lstrip()
+    
+    # Cheap shape check first, so plain-text answers never pay for a failed decode
+    if not body.startswith(('{', '[')):
+        return text
+    try:
+        return orjson.loads(body) if orjson is not None else json.loads(body)
+    except ValueError:
+        return text
+
+
+def dumps_coupon_info(obj: Any) -> str:
+    """
+    Serialize parsed coupon info to compact JSON, using orjson when available.
+    
+    Args:
+        obj: JSON-compatible object
+        
+    Returns:
+        JSON text without insignificant whitespace
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj).decode('utf-8')
+        except TypeError:
+            # e.g. non-string keys or integers wider than 64 bits
+            pass
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
 class VertexAIService:
     """Service for interacting with Vertex AI (Gemini) API."""
     
@@ -26,12 +172,36 @@ class VertexAIService:
         self.project_id = project_id
         self.location = location
         self.model_name = model_name
+        self._model = None
+        self._model_lock = threading.Lock()
+        
+        logger.info(f"Configured Vertex AI with model: {model_name}")
+    
+    def _ensure_model(self):
+        """
+        Get the Gemini model, initializing Vertex AI on first use.
         
-        # Initialize Vertex AI
-        vertexai.init(project=project_id, location=location)
-        self.model = GenerativeModel(model_name)
+        SDK setup (credential discovery, client creation) is deferred to the
+        first extraction, so runs that never call Gemini don't pay for it.
         
-        logger.info(f"Initialized Vertex AI with model: {model_name}")
+        Returns:
+            GenerativeModel for the configured model name
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    import vertexai
+                    from vertexai.generative_models import GenerativeModel
+                    
+                    vertexai.init(project=self.project_id, location=self.location)
+                    self._model = GenerativeModel(self.model_name)
+                    logger.info(f"Initialized Vertex AI with model: {self.model_name}")
+        return self._model
+    
+    @property
+    def model(self):
+        """Gemini model, initialized on first access."""
+        return self._ensure_model()
     
     def _create_extraction_prompt(self, filename: str, metadata: Dict) -> str:
         """
@@ -44,80 +214,77 @@ class VertexAIService:
         Returns:
             Formatted prompt string
         """
-        prompt = f"""You are analyzing a Direct Mail PDF proof for a dealership.
-
-File: {filename}
-Metadata: {metadata}
-
-Please extract the following information about coupon offers from this document:
-1. Coupon offer description (e.g., "$500 off", "0% APR for 60 months", "Free oil changes for 1 year")
-2. Expiration date (if mentioned)
-3. Terms and conditions (brief summary)
-4. Target vehicle models or types (if specified)
-5. Any special requirements or restrictions
-
-Format your response as a structured JSON object with the following keys:
-- offers: List of offer descriptions
-- expiration_date: The expiration date if found, otherwise null
-- terms: Brief summary of terms and conditions
-- target_vehicles: List of vehicle models or types
-- restrictions: Any special requirements
-
-If no coupon information is found, return an empty offers list.
-"""
-        return prompt
+        try:
+            # Items keep insertion order, so the cached prompt renders metadata
+            # exactly as the dict would
+            return _prompt_for(filename, tuple(metadata.items()))
+        except TypeError:
+            # Unhashable metadata values; build the prompt uncached
+            return _prompt_for.__wrapped__(filename, tuple(metadata.items()))
+    
+    @lazy_retry(_retry_policy, _is_retryable)
+    def _generate_text(self, contents: Any, generation_config: Dict) -> str:
+        """
+        Send one generate_content request, retrying on failure.
+        
+        Args:
+            contents: Prompt, or list of prompt and Parts
+            generation_config: Generation settings for the request
+            
+        Returns:
+            Response text
+        """
+        response = self._ensure_model().generate_content(
+            contents,
+            generation_config=generation_config
+        )
+        return response.text
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     def extract_coupon_info(
         self, 
         filename: str, 
         metadata: Dict,
         pdf_content: Optional[bytes] = None,
         temperature: float = 0.2,
-        max_output_tokens: int = 2048
-    ) -> str:
+        max_output_tokens: int = 2048,
+        gcs_uri: Optional[str] = None
+    ) -> Any:
         """
         Extract coupon information from PDF using Gemini.
         
+        The first call also initializes the Vertex AI SDK (see _ensure_model).
+        The request is built once and only the API call is retried, so a
+        retry doesn't copy the PDF into a new Part.
+        
         Args:
             filename: Name of the PDF file
             metadata: Extracted metadata from filename/path
             pdf_content: Optional PDF content as bytes (for full PDF analysis)
             temperature: Temperature for model generation (0.0-1.0)
             max_output_tokens: Maximum tokens in response
+            gcs_uri: Optional gs:// URI of the PDF; used instead of
+                pdf_content so Gemini reads the file from Cloud Storage
             
         Returns:
-            Extracted information as a string (JSON format)
+            Extracted information, parsed into a dict/list when the model
+            returned JSON, otherwise the raw response text
         """
         try:
             prompt = self._create_extraction_prompt(filename, metadata)
+            generation_config = {
+                'temperature': temperature,
+                'max_output_tokens': max_output_tokens,
+            }
             
-            # If PDF content is provided, include it in the request
-            if pdf_content:
-                # Create a Part object for the PDF
-                pdf_part = Part.from_data(
-                    data=pdf_content,
-                    mime_type="application/pdf"
-                )
-                
-                response = self.model.generate_content(
-                    [prompt, pdf_part],
-                    generation_config={
-                        'temperature': temperature,
-                        'max_output_tokens': max_output_tokens,
-                    }
-                )
+            # If the PDF is provided, include it in the request
+            pdf_part = _pdf_part(pdf_content, gcs_uri)
+            if pdf_part is not None:
+                text = self._generate_text([prompt, pdf_part], generation_config)
             else:
                 # Text-only analysis based on metadata
-                response = self.model.generate_content(
-                    prompt,
-                    generation_config={
-                        'temperature': temperature,
-                        'max_output_tokens': max_output_tokens,
-                    }
-                )
+                text = self._generate_text(prompt, generation_config)
             
-            result = response.text
+            result = parse_coupon_info(text)
             logger.debug(f"Extracted coupon info for {filename}")
             return result
             
@@ -125,39 +292,135 @@ If no coupon information is found, return an empty offers list.
             logger.error(f"Error extracting coupon info for {filename}: {error}")
             raise
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    def _fuse_batch(
+        self,
+        chunk: List[Dict],
+        temperature: float = 0.2,
+        max_output_tokens: int = 2048,
+        max_request_output_tokens: int = DEFAULT_MAX_REQUEST_OUTPUT_TOKENS
+    ) -> Optional[list]:
+        """
+        Extract coupon information for several PDFs in a single Gemini call.
+        
+        Args:
+            chunk: File dictionaries, each with 'filename', 'metadata' and
+                'gcs_uri' or 'pdf_content'
+            temperature: Temperature for model generation
+            max_output_tokens: Maximum tokens per file in the response
+            max_request_output_tokens: Maximum tokens in the whole response
+            
+        Returns:
+            One parsed result per file in ``chunk`` order, or None if the
+            response couldn't be split into per-file results
+        """
+        count = len(chunk)
+        contents = [_FUSED_PROMPT_HEADER.format(count=count)]
+        for number, data in enumerate(chunk, start=1):
+            contents.append(
+                f"Document {number}: File: {data['filename']}\n"
+                f"Metadata: {data.get('metadata', {})}\n"
+            )
+            contents.append(_pdf_part(data.get('pdf_content'), data.get('gcs_uri')))
+        contents.append(_FUSED_PROMPT_BODY.format(count=count))
+        
+        text = self._generate_text(contents, {
+            'temperature': temperature,
+            'max_output_tokens': min(max_output_tokens * count, max_request_output_tokens),
+        })
+        
+        results = parse_coupon_info(text)
+        if not isinstance(results, list) or len(results) != count:
+            return None
+        return results
+    
     def batch_extract_coupon_info(
         self, 
         file_data: list,
         temperature: float = 0.2,
-        max_output_tokens: int = 2048
+        max_output_tokens: int = 2048,
+        max_workers: int = 8,
+        files_per_request: int = 1,
+        max_request_output_tokens: int = DEFAULT_MAX_REQUEST_OUTPUT_TOKENS
     ) -> list:
         """
-        Extract coupon information from multiple files.
+        Extract coupon information from multiple files concurrently.
+        
+        Each file's request waits on a Gemini round trip, so requests are
+        spread over a thread pool; results keep the order of ``file_data``.
+        With ``files_per_request`` above 1, files with a PDF attached are sent
+        to Gemini in groups of that size, one request per group, falling back
+        to per-file requests when a group's response can't be split up.
         
         Args:
-            file_data: List of dictionaries with 'filename', 'metadata', and optionally 'pdf_content'
+            file_data: List of dictionaries with 'filename', 'metadata', and optionally
+                'gcs_uri' (preferred) or 'pdf_content'
             temperature: Temperature for model generation
             max_output_tokens: Maximum tokens in response
+            max_workers: Maximum number of concurrent requests
+            files_per_request: Maximum number of PDFs combined into one request
+            max_request_output_tokens: Model's output token limit, capping a
+                combined request's response
             
         Returns:
-            List of extracted information strings
+            List of extracted information (see extract_coupon_info)
         """
-        results = []
+        total = len(file_data)
         
-        for idx, data in enumerate(file_data):
+        def extract(idx: int) -> Any:
+            data = file_data[idx]
             try:
-                logger.info(f"Processing file {idx + 1}/{len(file_data)}: {data['filename']}")
-                result = self.extract_coupon_info(
+                logger.info(f"Processing file {idx + 1}/{total}: {data['filename']}")
+                return self.extract_coupon_info(
                     filename=data['filename'],
                     metadata=data.get('metadata', {}),
                     pdf_content=data.get('pdf_content'),
                     temperature=temperature,
-                    max_output_tokens=max_output_tokens
+                    max_output_tokens=max_output_tokens,
+                    gcs_uri=data.get('gcs_uri')
                 )
-                results.append(result)
             except Exception as error:
                 logger.error(f"Failed to process {data['filename']}: {error}")
-                results.append(f"Error: {str(error)}")
+                return f"Error: {str(error)}"
+        
+        def extract_group(indices: List[int]) -> list:
+            if len(indices) > 1:
+                logger.info(f"Processing files {indices[0] + 1}-{indices[-1] + 1}/{total} in one request")
+                try:
+                    results = self._fuse_batch(
+                        [file_data[idx] for idx in indices],
+                        temperature=temperature,
+                        max_output_tokens=max_output_tokens,
+                        max_request_output_tokens=max_request_output_tokens
+                    )
+                except Exception as error:
+                    logger.warning(f"Combined request failed, retrying files one by one: {error}")
+                    results = None
+                else:
+                    if results is None:
+                        logger.warning("Combined response didn't match the files, retrying one by one")
+                if results is not None:
+                    return results
+            return [extract(idx) for idx in indices]
+        
+        # Group PDFs for combined requests; everything else goes alone
+        groups = []
+        if files_per_request > 1:
+            pdf_indices = [
+                idx for idx, data in enumerate(file_data)
+                if data.get('gcs_uri') or data.get('pdf_content')
+            ]
+            pdf_set = set(pdf_indices)
+            groups.extend(
+                pdf_indices[start:start + files_per_request]
+                for start in range(0, len(pdf_indices), files_per_request)
+            )
+            groups.extend([idx] for idx in range(total) if idx not in pdf_set)
+        else:
+            groups.extend([idx] for idx in range(total))
         
+        results = [None] * total
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for indices, group_results in zip(groups, executor.map(extract_group, groups)):
+                for idx, result in zip(indices, group_results):
+                    results[idx] = result
         return results